@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# ./bench.py --help
+
+import os
+import sys
+import time
+import shutil
+import pathlib
+import argparse
+import tempfile
+import subprocess
+
+import synth
+
+assert sys.version_info >= (3, 8)
+
+
+def timeit(fct, repeat: int) -> float:
+    """Melhor tempo (em segundos) entre `repeat' execuções."""
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fct()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def report(nome: str, n: int, t: float):
+    print(f"  > {nome:<28} {n:>7} alunos: {t*1e3:>9.1f} ms "
+          f"({n / t:>10.1f} alunos/s)")
+
+
+def bench_pauta_export(sizes, repeat):
+    from moodle_to_atena import write_pauta
+
+    print("Exportação da pauta (PautaAtena.csv + PautaAtena.xls):")
+    for n in sizes:
+        pauta = synth.synth_pauta(n)
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            tmpdir = pathlib.Path(tmpdirname)
+            t = timeit(lambda: write_pauta(pauta, tmpdir / "p.csv",
+                                           tmpdir / "p.xls"),
+                       repeat)
+            report("write_pauta", n, t)
+
+            # Caminho antigo, via pandas (o .xls só funciona nas versões
+            # do pandas que ainda suportam o xlwt como engine).
+            try:
+                import pandas as pd
+            except ModuleNotFoundError:
+                continue
+
+            def old_path():
+                df = pd.DataFrame(pauta)
+                df.to_csv(tmpdir / "old.csv", index=False)
+                df.to_excel(tmpdir / "old.xls", index=False,
+                            header=False, engine='xlwt')
+            try:
+                t = timeit(old_path, repeat)
+            except (ValueError, ImportError) as e:
+                print(f"  > {'DataFrame.to_excel':<28} {n:>7} alunos: "
+                      f"indisponível ({e})")
+            else:
+                report("DataFrame.to_excel", n, t)
+
+
+def bench_gab_read(sizes, repeat):
+    from gab import Gab
+
+    print("Leitura do .gab (Gab.from_gab_file):")
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            path = pathlib.Path(tmpdirname) / "Lote.gab"
+            pauta = synth.synth_pauta(n)
+            synth.synth_gab(pauta).to_gab_file(path)
+            t = timeit(lambda: Gab.from_gab_file(path), repeat)
+            report("Gab.from_gab_file", n, t)
+            jobs = os.cpu_count() or 1
+            if jobs > 1:
+                tp = timeit(lambda: Gab.from_gab_file(path, jobs=jobs),
+                            repeat)
+                report(f"Gab.from_gab_file(jobs={jobs})", n, tp)
+                print(f"    (speedup: {t / tp:.2f}x)")
+            else:
+                print("    (só 1 CPU: leitura em paralelo não medida)")
+
+
+# Diretório dos scripts (para poder rodá-los a partir de outro cwd)
+SCRIPTS_DIR = pathlib.Path(__file__).resolve().parent
+
+
+def run_script(script: str, *args, cwd):
+    subprocess.run(
+        [sys.executable, os.fspath(SCRIPTS_DIR / script), *args],
+        cwd=cwd, check=True,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def bench_grade(sizes, repeat):
+    print("Correção (grade.py, incluindo a inicialização do Python):")
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            tmpdir = pathlib.Path(tmpdirname)
+            synth.synth_all(tmpdir, n, pdf=False)
+            t = timeit(lambda: run_script(
+                "grade.py", "--no-colors", "PautaAtena.csv",
+                "Respostas.csv", "Lote.gab", cwd=tmpdir), repeat)
+            report("grade.py", n, t)
+
+
+def bench_split_pdfs(sizes, repeat):
+    print("Separação do lote (split_pdfs.py, incluindo a "
+          "inicialização do Python):")
+    if shutil.which('pdfgrep') is None:
+        print("  > pdfgrep não encontrado, pulando.")
+        return
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            tmpdir = pathlib.Path(tmpdirname)
+            skip_pages = synth.synth_all(tmpdir, n)
+
+            def split(*opts):
+                shutil.rmtree(tmpdir / "Provas", ignore_errors=True)
+                run_script(
+                    "split_pdfs.py", "--no-colors", *opts, "Lote.pdf",
+                    str(skip_pages), "PautaAtena.csv",
+                    "known_values.csv", "Provas", cwd=tmpdir)
+            t = timeit(split, repeat)
+            report("split_pdfs.py", n, t)
+            t = timeit(lambda: split("--by-dre"), repeat)
+            report("split_pdfs.py --by-dre", n, t)
+
+
+BENCHMARKS = {
+    'pauta_export': bench_pauta_export,
+    'gab_read': bench_gab_read,
+    'grade': bench_grade,
+    'split_pdfs': bench_split_pdfs,
+}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Mede o desempenho dos scripts com dados "
+                    "sintéticos.")
+
+    parser.add_argument(
+        "BENCH",
+        help=f"Quais benchmarks rodar, entre: {', '.join(BENCHMARKS)} "
+             f"(default: todos).",
+        nargs='*',
+        default=[],
+    )
+
+    parser.add_argument(
+        "--sizes",
+        help="Quantidades de alunos, separadas por vírgula.",
+        type=lambda s: [int(x) for x in s.split(',')],
+        default=[100, 1000, 10000],
+    )
+
+    parser.add_argument(
+        "--repeat",
+        help="Quantas vezes repetir cada medição (vale a melhor).",
+        type=int,
+        default=3,
+    )
+
+    args = parser.parse_args()
+
+    for nome in args.BENCH:
+        if nome not in BENCHMARKS:
+            parser.error(f"Benchmark desconhecido: {nome}")
+
+    for nome in args.BENCH or BENCHMARKS:
+        BENCHMARKS[nome](args.sizes, args.repeat)
@@ -1,13 +1,19 @@
 from __future__ import annotations  # só até o Python 3.10 (PEP 563)
 
 import codecs
+import collections
+import concurrent.futures
 import functools
+import json
+import mmap
 import pathlib
 import shutil
 import sys
 import tempfile
 from typing import Tuple, List  # só até Python 3.9 (PEP 585)
-from typing import Optional, NamedTuple
+from typing import Dict, Iterable, Iterator, Optional, NamedTuple
+
+import instrument
 
 # O py2jdbc está bugado em um dos sistemas testados.
 # Plano B: tenta ler os casos fáceis na mão, e falha nos casos difíceis.
@@ -37,12 +43,31 @@ class Gab:
         self.testes_sem_nome = None
         self.keys = None
 
+        # Arquivo .gab de onde os testes são lidos (para o iter_tests
+        # de um Gab lido com lazy_from_gab_file), e o índice dele
+        self.path = None
+        self.index = None
+
+        # Índice nome -> testes, para os testes que estão na memória
+        self._by_nome = None
+
     # TODO: deveria retornar uma cópia!!
     def get_test_by_st_name(self, nome: str):
-        matches = []
-        for t in self.testes_com_nome:
-            if t.st.nome == nome:
-                matches.append(t)
+        if self.testes_com_nome is None and self.index is not None:
+            # Lê do arquivo somente os testes com esse nome
+            matches = [self.read_test(i)
+                       for i in self.index.find(nome=nome)]
+        elif self.testes_com_nome is not None:
+            if self._by_nome is None:
+                self._by_nome = {}
+                for t in self.testes_com_nome:
+                    self._by_nome.setdefault(t.st.nome, []).append(t)
+            matches = self._by_nome.get(nome, [])
+        else:
+            matches = []
+            for t in self.iter_tests():
+                if t.st and t.st.nome == nome:
+                    matches.append(t)
         if len(matches) == 0:
             raise KeyError("Nome {nome} não encontrado no .gab")
         elif len(matches) > 1:
@@ -54,7 +79,7 @@ class Gab:
         return [k.length for k in self.keys]
 
     @classmethod
-    def from_gab_file(cls, path, verbose=False):
+    def from_gab_file(cls, path, verbose=False, jobs=1):
         if verbose:
             print(f"  > Arquivo {path}:")
         with _GabReader(path) as reader:
@@ -76,7 +101,10 @@ class Gab:
 
             # Testes
             gab.testes_com_nome, gab.testes_sem_nome, gab.keys = \
-                reader.read_check_tests_keys()
+                reader.read_check_tests_keys(jobs=jobs)
+            instrument.count('gab.testes_validados',
+                             len(gab.testes_com_nome)
+                             + len(gab.testes_sem_nome))
             if verbose:
                 print("    Testes lidos:")
                 print(f"      . com nome:   {len(gab.testes_com_nome)}")
@@ -86,20 +114,100 @@ class Gab:
 
         return gab
 
+    @classmethod
+    def lazy_from_gab_file(cls, path, verbose=False, index=False,
+                           index_path=None):
+        """Como o from_gab_file, mas não guarda os testes na memória: lê
+        só o cabeçalho e o primeiro teste (para montar as chaves). Os
+        testes podem depois ser percorridos com `iter_tests'.
+
+        O arquivo só é validado por inteiro quando os testes são
+        percorridos até o final.
+
+        Se `index', usa o índice (ver `GabIndex') salvo em
+        `index_path' (por padrão, ao lado do .gab), criando ou
+        recriando o índice se necessário. Com o índice, o
+        `get_test_by_st_name' e o `read_test' leem somente o teste
+        pedido do arquivo.
+        """
+        if verbose:
+            print(f"  > Arquivo {path}:")
+        with _GabReader(path) as reader:
+            reader.read_check_magic()
+            fmt = reader.read_check_fmt()
+            nt, ni, mna, dk = reader.read_check_header()
+            gab = cls(fmt, nt, ni, mna, dk)
+            next(reader.iter_check_tests())
+            gab.keys = reader.keys()
+        gab.path = pathlib.Path(path)
+        if verbose:
+            print(f"      . num_tests          = {nt}")
+            print(f"      . num_items          = {ni}")
+        if index:
+            if index_path is None:
+                index_path = GabIndex.default_path(path)
+            gab.index = GabIndex.load_or_build(path, index_path)
+            if verbose:
+                print(f"      . índice             = {index_path}")
+        return gab
+
+    def read_test(self, ordinal: int) -> MCTest:
+        """Lê do arquivo somente o teste de número `ordinal' (começando
+        do zero), usando o índice."""
+        if self.index is None:
+            raise GabReaderRuntimeError("Este Gab não tem índice.")
+        with _GabReader(self.path) as reader:
+            reader.read_check_magic()
+            reader.read_check_fmt()
+            reader.read_check_header()
+            instrument.count('gab.testes_lidos_pelo_indice')
+            return reader.seek_check_test(self.index.offsets[ordinal])
+
+    def iter_tests(self) -> Iterator[MCTest]:
+        """Itera pelos testes (primeiro os com nome, depois os sem nome).
+
+        Se este Gab foi lido com `lazy_from_gab_file', os testes são
+        lidos e validados do arquivo um de cada vez, com memória
+        constante. Se não, são os testes que já estão na memória.
+        """
+        if self.testes_com_nome is not None:
+            yield from self.testes_com_nome
+            yield from self.testes_sem_nome
+            return
+        with _GabReader(self.path) as reader:
+            reader.read_check_magic()
+            reader.read_check_fmt()
+            if reader.read_check_header() != (
+                    self.num_tests, self.num_items, self.max_num_ans,
+                    self.dont_know):
+                raise GabReaderRuntimeError(
+                    f"{self.path}: arquivo mudou desde que foi aberto.")
+            for t in reader.iter_check_tests():
+                instrument.count('gab.testes_validados')
+                yield t
+            reader.assert_eof()
+
     @staticmethod
     def _pop_int_from_str(string):
         """Lê um dígito no início da string."""
         num_digits = 0
-        while string[num_digits].isdecimal():
+        while (num_digits < len(string)
+               and string[num_digits].isdecimal()):
             num_digits += 1
         if num_digits == 0:
             raise ValueError("Linha deve começar com o número do item.")
         return int(string[:num_digits]), string[num_digits:]
 
-    def update_from_addendum(self, path, verbose=False):
+    def compile_addendum(self, path, verbose=False) -> Dict[int, int]:
+        """Lê um .adg e retorna as chaves que ele define, sem alterar
+        este Gab: um dict que leva o número do item (começando do zero)
+        na máscara de bits das alternativas corretas (0 para item
+        anulado). Cada linha do adendo substitui a chave inteira do
+        item, então se o item aparece mais de uma vez vale a última."""
         if verbose:
             print(f"  > Arquivo {path}:")
         path = pathlib.Path(path)
+        delta = {}
         with path.open() as file:
             for line in file:
                 line = line.strip()
@@ -114,12 +222,16 @@ class Gab:
                     raise ValueError("Faltando ':'")
                 line = line[1:]
                 line = line.strip()
-                self.keys[item] = _GabReader.MCKey(0, self.max_num_ans)
+                if not line:
+                    raise ValueError(
+                        f"Faltando as respostas corretas do item "
+                        f"{item + 1}")
+                mask = 0
                 item_str = f"{item + 1:>{len(str(self.num_items))}}"
                 if line[0] == '-':
                     if verbose:
                         print(f"      . {item_str}: -")
-                    pass  # mantém o self.keys[item] "==0"
+                    pass  # mantém a máscara "==0"
                 elif not line[0].isalpha():
                     raise ValueError(
                         f"Esperava as respostas corretas do item "
@@ -134,18 +246,154 @@ class Gab:
                             idx = self.max_num_ans - 1
                         else:
                             idx = ord(char) - ord('A')
-                            if idx not in range(self.keys[item].length):
+                            if idx not in range(self.max_num_ans):
                                 raise ValueError(
                                     f"Resposta \"{char}\" inválida "
                                     f"para o item {item + 1}")
-                        self.keys[item] |= 1 << idx
+                        mask |= 1 << idx
                     if verbose:
-                        letras = self.keys[item].letras(
-                            last_is_dk=self.dont_know)
+                        letras = _GabReader.MCKey(
+                            mask, self.max_num_ans).letras(
+                                last_is_dk=self.dont_know)
                         print(f"      . {item_str}: {letras}")
+                delta[item] = mask
+        return delta
+
+    def update_from_addenda(self, paths, verbose=False) -> List[
+        Tuple[int, str, str]
+    ]:
+        """Aplica vários adendos, em ordem, de uma vez só.
+
+        Todos os adendos são lidos e validados antes de alterar
+        qualquer chave (se algum for inválido, as chaves não mudam).
+        Retorna a lista das chaves que mudaram, como tuplas (item
+        começando do zero, letras antes, letras depois).
+        """
+        delta = {}
+        for path in paths:
+            delta.update(self.compile_addendum(path, verbose=verbose))
+        diff = []
+        for item, mask in sorted(delta.items()):
+            old = self.keys[item]
+            new = _GabReader.MCKey(mask, self.max_num_ans)
+            if (old.items, old.length) != (new.items, new.length):
+                diff.append((item,
+                             old.letras(last_is_dk=self.dont_know),
+                             new.letras(last_is_dk=self.dont_know)))
+            self.keys[item] = new
+        return diff
+
+    def update_from_addendum(self, path, verbose=False):
+        return self.update_from_addenda([path], verbose=verbose)
+
+    @staticmethod
+    def write_gab_file(path,
+                       fmt: str,
+                       num_tests: int,
+                       num_items: int,
+                       max_num_ans: int,
+                       dont_know: bool,
+                       tests: Iterable[MCTest]):
+        """Escreve um .gab a partir de um iterável de testes, um de cada
+        vez (e.g. um generator), sem precisar ter todos na memória.
+
+        Os testes com nome devem vir antes dos sem nome, e devem ser
+        exatamente `num_tests'.
+        """
+        with _GabWriter(path) as writer:
+            writer.write_magic()
+            writer.write_fmt(fmt)
+            writer.write_header(num_tests, num_items, max_num_ans,
+                                dont_know)
+            for t in tests:
+                writer.write_test(t)
+            writer.assert_complete()
+
+    def to_gab_file(self, path):
+        """Escreve este gabarito no formato binário do AtenaME.
+
+        O formato .gab não guarda as chaves: a resposta certa de cada
+        item é sempre a primeira alternativa original. Se este gabarito
+        tiver sido alterado por adendos, use também `to_addendum_file'.
+        """
+        self.write_gab_file(
+            path, self.fmt, self.num_tests, self.num_items,
+            self.max_num_ans, self.dont_know, self.iter_tests())
+
+    def to_addendum_file(self, path):
+        """Escreve um .adg com todas as chaves deste gabarito que
+        diferem da chave padrão (só a primeira alternativa correta), de
+        forma que `update_from_addendum' reproduz as chaves atuais a
+        partir do .gab original."""
+        path = pathlib.Path(path)
+        width = len(str(self.num_items))
+        with path.open('w') as file:
+            file.write("* Adendo gerado a partir das chaves do Gab\n")
+            for i, k in enumerate(self.keys):
+                if k.items == 1 << 0:
+                    continue
+                letras = k.letras(last_is_dk=self.dont_know) or '-'
+                file.write(f"{i + 1:>{width}}: {letras}\n")
+
+    @classmethod
+    def merge(cls, gabs: List[Gab], verbose=False) -> Gab:
+        """Junta os gabaritos de vários lotes da mesma prova num só.
+
+        Todos devem ter o mesmo formato, a mesma quantidade de itens e
+        de respostas em cada item, e as mesmas chaves (já com os
+        adendos). Os testes com nome de todos os lotes vêm primeiro, na
+        ordem dos lotes, seguidos dos testes sem nome. Um mesmo nome de
+        aluno não pode aparecer em mais de um teste.
+        """
+        if not gabs:
+            raise ValueError("Nenhum gabarito para juntar.")
+        first = gabs[0]
+        for g in gabs:
+            if g.testes_com_nome is None:
+                raise ValueError("Só é possível juntar gabaritos que "
+                                 "estão inteiros na memória.")
+            for attr in ('fmt', 'num_items', 'max_num_ans',
+                         'dont_know'):
+                if getattr(g, attr) != getattr(first, attr):
+                    raise ValueError(
+                        f"Gabaritos com {attr} diferentes: "
+                        f"{getattr(first, attr)} e {getattr(g, attr)}.")
+            if [(k.length, k.items) for k in g.keys] != \
+                    [(k.length, k.items) for k in first.keys]:
+                raise ValueError(
+                    f"Gabaritos com chaves diferentes:\n"
+                    f"  {first.keys}\n  {g.keys}")
+        gab = cls(first.fmt, sum(g.num_tests for g in gabs),
+                  first.num_items, first.max_num_ans, first.dont_know)
+        gab.testes_com_nome = [t for g in gabs
+                               for t in g.testes_com_nome]
+        gab.testes_sem_nome = [t for g in gabs
+                               for t in g.testes_sem_nome]
+        gab.keys = [_GabReader.MCKey(k.items, k.length)
+                    for k in first.keys]
+        nomes = collections.Counter(t.st.nome
+                                    for t in gab.testes_com_nome)
+        repetidos = [n for n, c in nomes.items() if c > 1]
+        if repetidos:
+            raise ValueError(f"Nomes em mais de um teste: {repetidos}")
+        if verbose:
+            print(f"  > {len(gabs)} gabaritos juntados:")
+            print(f"      . num_tests          = {gab.num_tests}")
+        return gab
 
     @classmethod
-    def from_zip_file(cls, path, verbose=False):
+    def from_file(cls, path, verbose=False, jobs=1):
+        """Lê um .gab ou um .zip do AtenaME (ver `from_zip_file')."""
+        path = pathlib.Path(path)
+        if path.suffix == '.gab':
+            return cls.from_gab_file(path, verbose=verbose, jobs=jobs)
+        elif path.suffix == '.zip':
+            return cls.from_zip_file(path, verbose=verbose, jobs=jobs)
+        else:
+            raise ValueError(f"Formato {path.suffix} não reconhecido.")
+
+    @classmethod
+    def from_zip_file(cls, path, verbose=False, jobs=1):
         """Monta o gabarito a partir do ZIP baixado do AtenaME.
 
         Se esse zip tiver um .adg com o mesmo nome que o .gab, lê também
@@ -176,7 +424,8 @@ class Gab:
             if len(files) != 1:
                 raise ValueError(f"Mais de um .gab dentro de {path}")
             gab_path = files[0]
-            gab = cls.from_gab_file(gab_path, verbose=verbose)
+            gab = cls.from_gab_file(gab_path, verbose=verbose,
+                                    jobs=jobs)
             adg_path = gab_path.with_suffix(".adg")
             if adg_path.exists():
                 gab.update_from_addendum(adg_path, verbose=verbose)
@@ -584,54 +833,184 @@ class _GabReader:
         return self.MCTest(perm=perm, st=st, items=items)
 
     @_assumes_file_open
-    def read_check_tests_keys(self) -> Tuple[
+    def _check_next_test(self, t: MCTest) -> None:
+        """Validações que envolvem mais de um teste (mesma quantidade de
+        respostas em cada item, mesma quantidade de campos, testes com
+        nome antes dos sem nome), para o próximo teste do arquivo."""
+        num_ans_list = [it.num_answers for it in t.items]
+        assert len(t.perm) == len(num_ans_list)
+        if self.num_ans_list_orig is None:
+            self.num_ans_list_orig = [None for _ in num_ans_list]
+            for j, N in zip(t.perm, num_ans_list):
+                self.num_ans_list_orig[j] = N
+        else:
+            for j, N in zip(t.perm, num_ans_list):
+                if self.num_ans_list_orig[j] != N:
+                    self._raise_invalid_gab(
+                        f"Teste com quantidade inválida de "
+                        f"respostas em cada item: {t.items}.")
+        if not self.seen_unnamed:
+            # Todos os testes até agora foram *com* nome
+            if t.st:
+                # O teste que acabamos de ler foi *com* nome
+                if self.num_fields is None:
+                    # Este é o primeiro teste do arquivo
+                    self.num_fields = len(t.st.fields)
+                else:
+                    if len(t.st.fields) != self.num_fields:
+                        self._raise_invalid_gab(
+                            f"Teste com quantidade inválida de "
+                            f"campos: {t.st}")
+            if not t.st:
+                # Este é o primeiro teste sem nome
+                self.seen_unnamed = True
+        else:
+            if t.st:
+                self._raise_invalid_gab(
+                    f"Teste com nome após teste sem nome: {t.st}")
+
+    @_assumes_file_open
+    def iter_check_tests(self) -> Iterator[MCTest]:
+        """Lê e valida os testes, um de cada vez.
+
+        As validações que envolvem mais de um teste são feitas à medida
+        que os testes são lidos, de forma que só o teste atual fica na
+        memória.
+        """
+        for _ in range(self.header_nt):
+            self.test_offset = self.file.tell()
+            t = self._read_check_test()
+            self._check_next_test(t)
+            yield t
+
+    @_assumes_file_open
+    def scan_test_offsets(self) -> Optional[List[int]]:
+        """Varredura rápida dos testes a partir da posição atual, sem
+        validar nada: só lê os tamanhos das permutações e das strings
+        para pular de um teste para o próximo.
+
+        Retorna a posição de início de cada teste, seguida da posição
+        do fim do último teste; ou None, se a estrutura do arquivo não
+        permitir a varredura (nesse caso, a leitura normal vai dar um
+        erro com a mensagem adequada).
+        """
+        pos = self.file.tell()
+        offsets = []
+        with mmap.mmap(self.file.fileno(), 0,
+                       access=mmap.ACCESS_READ) as mm:
+            size = len(mm)
+
+            def read_int(pos):
+                return int.from_bytes(mm[pos:pos + self.SIZEOF_INT],
+                                      byteorder='big', signed=True)
+
+            for _ in range(self.header_nt):
+                offsets.append(pos)
+                if pos + self.SIZEOF_INT > size:
+                    return None
+                n = read_int(pos)
+                if n <= 0:
+                    return None
+                pos += self.SIZEOF_INT * (1 + n)
+                if pos + self.SIZEOF_USHORT > size:
+                    return None
+                pos += self.SIZEOF_USHORT + int.from_bytes(
+                    mm[pos:pos + self.SIZEOF_USHORT], byteorder='big')
+                for _ in range(n):
+                    if pos + self.SIZEOF_INT > size:
+                        return None
+                    m = read_int(pos)
+                    if m <= 0:
+                        return None
+                    # permutação, mais 5 inteiros: c, nr, no, co, xor
+                    pos += self.SIZEOF_INT * (1 + m + 5)
+            if pos > size:
+                return None
+        offsets.append(pos)
+        return offsets
+
+    @_assumes_file_open
+    def iter_check_tests_parallel(self, jobs: int) -> Iterator[MCTest]:
+        """Como o iter_check_tests, mas valida os testes em `jobs'
+        processos.
+
+        Primeiro faz uma varredura rápida (scan_test_offsets) para
+        dividir o arquivo em pedaços com vários testes cada; cada
+        pedaço é lido e validado (_read_check_test) por um processo; e
+        as validações entre testes são feitas aqui, na ordem do
+        arquivo. Um processo que encontra um teste inválido devolve o
+        erro junto com os testes anteriores do pedaço, e o erro só é
+        levantado aqui depois das validações entre testes desses
+        anteriores; assim, os erros são os mesmos (inclusive as
+        posições no arquivo) que os da leitura serial.
+        """
+        offsets = self.scan_test_offsets()
+        if offsets is None:
+            # Arquivo inválido: a leitura serial acha o erro
+            yield from self.iter_check_tests()
+            return
+        num_chunks = min(self.header_nt, 4 * jobs)
+        bounds = [self.header_nt * k // num_chunks
+                  for k in range(num_chunks + 1)]
+        starts = bounds[:-1]
+        counts = [b - a for a, b in zip(bounds[:-1], bounds[1:])]
+        with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+            chunks = executor.map(
+                _read_check_tests_chunk,
+                [self.path] * num_chunks,
+                [offsets[i] for i in starts],
+                counts)
+            i = 0
+            for chunk, erro in chunks:
+                for t in chunk:
+                    self.test_offset = offsets[i]
+                    self.file.seek(offsets[i + 1])
+                    self._check_next_test(t)
+                    yield t
+                    i += 1
+                if erro is not None:
+                    self.test_offset, e = erro
+                    raise e
+        self.file.seek(offsets[-1])
+
+    @_assumes_file_open
+    def seek_check_test(self, offset: int) -> MCTest:
+        """Lê e valida somente o teste que começa em `offset'. As
+        validações entre testes diferentes não são feitas."""
+        if not self.read_header:
+            raise GabReaderRuntimeError("Cabeçalho ainda não foi lido!")
+        self.file.seek(offset)
+        return self._read_check_test()
+
+    def keys(self) -> List[MCKey]:
+        """Chaves padrão (só a primeira alternativa original correta).
+        Só pode ser chamado depois de ler pelo menos um teste."""
+        if self.num_ans_list_orig is None:
+            raise GabReaderRuntimeError("Nenhum teste foi lido ainda!")
+        return [self.MCKey(1 << 0, length=nr)
+                for nr in self.num_ans_list_orig]
+
+    @_assumes_file_open
+    def read_check_tests_keys(self, jobs: int = 1) -> Tuple[
         List[MCTest], List[MCTest], List[MCKey]
     ]:
-        """Retorna: testes com nome, testes sem nome, e as chaves."""
+        """Retorna: testes com nome, testes sem nome, e as chaves.
+
+        Se `jobs' > 1, valida os testes em paralelo (ver
+        iter_check_tests_parallel).
+        """
         testes_com_nome = []
         testes_sem_nome = []
-        num_fields: int
-        num_ans_list: List[int]
-        num_ans_list_orig = None
-        for _ in range(self.header_nt):
-            t = self._read_check_test()
-            num_ans_list = [it.num_answers for it in t.items]
-            if num_ans_list_orig is None:
-                num_ans_list_orig = [None for _ in num_ans_list]
-                assert len(t.perm) == len(num_ans_list)
-                for j, N in zip(t.perm, num_ans_list):
-                    num_ans_list_orig[j] = N
-            else:
-                assert len(t.perm) == len(num_ans_list)
-                for j, N in zip(t.perm, num_ans_list):
-                    if num_ans_list_orig[j] != N:
-                        self._raise_invalid_gab(
-                            f"Teste com quantidade inválida de "
-                            f"respostas em cada item: {t.items}.")
-            if len(testes_sem_nome) == 0:
-                # Todos os testes até agora foram *com* nome
-                if t.st:
-                    # O teste que acabamos de ler foi *com* nome
-                    if len(testes_com_nome) == 0:
-                        # Este é o primeiro teste do arquivo
-                        num_fields = len(t.st.fields)
-                    else:
-                        if len(t.st.fields) != num_fields:
-                            self._raise_invalid_gab(
-                                f"Teste com quantidade inválida de "
-                                f"campos: {t.st}")
-                    testes_com_nome.append(t)
-                if not t.st:
-                    # Este é o primeiro teste sem nome
-                    testes_sem_nome.append(t)
+        if jobs > 1:
+            tests = self.iter_check_tests_parallel(jobs)
+        else:
+            tests = self.iter_check_tests()
+        for t in tests:
+            if t.st:
+                testes_com_nome.append(t)
             else:
-                if t.st:
-                    self._raise_invalid_gab(
-                        f"Teste com nome após teste sem nome: {t.st}")
                 testes_sem_nome.append(t)
-        keys = [self.MCKey(1 << 0, length=nr)
-                for nr in num_ans_list_orig]
-        return testes_com_nome, testes_sem_nome, keys
+        return testes_com_nome, testes_sem_nome, self.keys()
 
     @_assumes_file_open
     def assert_eof(self) -> None:
@@ -647,6 +1026,10 @@ class _GabReader:
         self.path = pathlib.Path(path).resolve()
         self.file = None
         self.read_header = False
+        self.num_ans_list_orig = None
+        self.num_fields = None
+        self.seen_unnamed = False
+        self.test_offset = None
 
     def __enter__(self):
         self.file = self.path.open('rb')
@@ -668,6 +1051,358 @@ class _GabReader:
         self.file.close()
 
 
+def _read_check_tests_chunk(path, offset: int, count: int) -> Tuple[
+    List[MCTest], Optional[Tuple[int, Exception]]
+]:
+    """Lê e valida `count' testes a partir de `offset' (sem as
+    validações entre testes). Roda nos processos do
+    iter_check_tests_parallel.
+
+    Retorna os testes lidos e, se algum for inválido, o erro (com a
+    posição do teste inválido) ao invés de levantá-lo: nesse caso, os
+    testes retornados são só os anteriores ao inválido.
+    """
+    tests = []
+    with _GabReader(path) as reader:
+        reader.read_check_magic()
+        reader.read_check_fmt()
+        reader.read_check_header()
+        reader.file.seek(offset)
+        for _ in range(count):
+            test_offset = reader.file.tell()
+            try:
+                tests.append(reader._read_check_test())
+            except Exception as e:
+                return tests, (test_offset, e)
+    return tests, None
+
+
+class GabIndex:
+    """Índice de um arquivo .gab, para acesso aleatório aos testes.
+
+    Como os testes têm tamanho variável, achar o teste de um aluno
+    exige ler o arquivo inteiro. O índice guarda, para cada teste, a
+    posição (em bytes) onde ele começa, o nome e os campos do aluno
+    (e.g. o DRE), de forma que um teste pode ser lido sozinho.
+
+    O índice é salvo num arquivo JSON ao lado do .gab (`default_path'),
+    junto com o tamanho e a data de modificação do .gab, para detectar
+    índices desatualizados.
+    """
+
+    VERSION = 1
+
+    def __init__(self, gab_size: int, gab_mtime_ns: int,
+                 offsets: List[int], nomes: List[Optional[str]],
+                 fields: List[List[str]]):
+        self.gab_size = gab_size
+        self.gab_mtime_ns = gab_mtime_ns
+        self.offsets = offsets
+        self.nomes = nomes
+        self.fields = fields
+        self._by_nome = None
+        self._by_field = None
+
+    @staticmethod
+    def default_path(gab_path) -> pathlib.Path:
+        gab_path = pathlib.Path(gab_path)
+        return gab_path.with_name(gab_path.name + ".idx")
+
+    @classmethod
+    def build(cls, gab_path) -> GabIndex:
+        """Lê (e valida) o .gab inteiro, uma única vez, e monta o
+        índice."""
+        stat = pathlib.Path(gab_path).stat()
+        offsets, nomes, fields = [], [], []
+        with _GabReader(gab_path) as reader:
+            reader.read_check_magic()
+            reader.read_check_fmt()
+            reader.read_check_header()
+            for t in reader.iter_check_tests():
+                instrument.count('gab.testes_validados')
+                offsets.append(reader.test_offset)
+                nomes.append(t.st.nome if t.st else None)
+                fields.append(t.st.fields if t.st else [])
+            reader.assert_eof()
+        return cls(stat.st_size, stat.st_mtime_ns, offsets, nomes,
+                   fields)
+
+    def save(self, path) -> None:
+        with pathlib.Path(path).open('w') as file:
+            json.dump({
+                'version': self.VERSION,
+                'gab_size': self.gab_size,
+                'gab_mtime_ns': self.gab_mtime_ns,
+                'offsets': self.offsets,
+                'nomes': self.nomes,
+                'fields': self.fields,
+            }, file, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path) -> GabIndex:
+        with pathlib.Path(path).open() as file:
+            d = json.load(file)
+        if d.get('version') != cls.VERSION:
+            raise ValueError(f"{path}: versão do índice desconhecida.")
+        return cls(d['gab_size'], d['gab_mtime_ns'], d['offsets'],
+                   d['nomes'], d['fields'])
+
+    def is_fresh(self, gab_path) -> bool:
+        """Se o .gab não mudou desde que o índice foi criado."""
+        stat = pathlib.Path(gab_path).stat()
+        return (stat.st_size == self.gab_size
+                and stat.st_mtime_ns == self.gab_mtime_ns)
+
+    @classmethod
+    def load_or_build(cls, gab_path, idx_path=None) -> GabIndex:
+        """Carrega o índice salvo em `idx_path' (por padrão, ao lado do
+        .gab) ou, se ele não existir ou estiver desatualizado, cria (e
+        salva) um novo."""
+        if idx_path is None:
+            idx_path = cls.default_path(gab_path)
+        if idx_path.exists():
+            index = cls.load(idx_path)
+            if index.is_fresh(gab_path):
+                return index
+        index = cls.build(gab_path)
+        index.save(idx_path)
+        return index
+
+    def find(self, nome: Optional[str] = None,
+             field: Optional[str] = None) -> List[int]:
+        """Números (ordinais) dos testes com esse nome de aluno e/ou com
+        um campo (e.g. DRE) igual a `field'."""
+        if self._by_nome is None:
+            self._by_nome = {}
+            self._by_field = {}
+            for i, (n, fs) in enumerate(zip(self.nomes, self.fields)):
+                if n is not None:
+                    self._by_nome.setdefault(n, []).append(i)
+                for f in set(fs):
+                    self._by_field.setdefault(f, []).append(i)
+        result = None
+        if nome is not None:
+            result = self._by_nome.get(nome, [])
+        if field is not None:
+            by_field = self._by_field.get(field, [])
+            result = by_field if result is None else \
+                [i for i in result if i in by_field]
+        if result is None:
+            raise ValueError("Especifique `nome' e/ou `field'.")
+        return list(result)
+
+
+class GabWriterError(Exception):
+    """Para erros do escritor de arquivos Gab."""
+    pass
+
+
+class _GabWriter:
+    """Escreve arquivos .gab do AtenaME, no mesmo formato lido pelo
+    _GabReader (ver a documentação dele).
+
+    Os testes são escritos um de cada vez, e os mesmos campos
+    redundantes que o _GabReader verifica (checksum, num_answers, etc.)
+    são calculados ou conferidos aqui.
+    """
+
+    ###
+    ### Conveniência
+    ###
+
+    def _assert_open(self):
+        if not self.is_open():
+            raise GabWriterError(f"File '{self.path}' is not open.")
+
+    ###
+    ### Low-level write by C type
+    ###
+
+    @_assumes_file_open
+    def _write_ushort(self, i: int) -> None:
+        self.file.write(i.to_bytes(_GabReader.SIZEOF_USHORT,
+                                   byteorder='big', signed=False))
+
+    @_assumes_file_open
+    def _write_int(self, i: int) -> None:
+        self.file.write(i.to_bytes(_GabReader.SIZEOF_INT,
+                                   byteorder='big', signed=True))
+
+    @_assumes_file_open
+    def _write_uint(self, i: int) -> None:
+        self.file.write(i.to_bytes(_GabReader.SIZEOF_UINT,
+                                   byteorder='big', signed=False))
+
+    ###
+    ### Write by Java type
+    ###
+
+    @_assumes_file_open
+    def _write_mutf8(self, string: str) -> None:
+        """Escreve uma string no arquivo."""
+        # Vale a mesma observação do _GabReader._read_mutf8: sem U+0000
+        # e só com caracteres do BMP, MUTF-8 e UTF-8 coincidem.
+        if '\0' in string or any(ord(c) > 0xFFFF for c in string):
+            raise GabWriterError(
+                f"String não suportada por este script: {string!r}")
+        byts = codecs.encode(string, 'utf-8')
+        if len(byts) >= 2**(8 * _GabReader.SIZEOF_USHORT):
+            raise GabWriterError(f"String muito longa: {string!r}")
+        self._write_ushort(len(byts))
+        self.file.write(byts)
+
+    ###
+    ### Write Gab conventions
+    ###
+
+    @_assumes_file_open
+    def _write_bool(self, b: bool) -> None:
+        self._write_uint(int(bool(b)))
+
+    @_assumes_file_open
+    def _write_permutation(self, perm: List[int]) -> None:
+        if sorted(perm) != list(range(len(perm))) or not perm:
+            raise GabWriterError(f"{perm} não é uma permutação.")
+        self._write_int(len(perm))
+        for el in perm:
+            self._write_int(el)
+
+    ###
+    ### Higher level Gab fields
+    ###
+
+    @_assumes_file_open
+    def write_magic(self) -> None:
+        self._write_uint(_GabReader.MAGIC_v2)
+
+    @_assumes_file_open
+    def write_fmt(self, fmt: str) -> None:
+        if fmt != "Formato 1":
+            raise NotImplementedError(f"Formato desconhecido: '{fmt}'.")
+        self._write_mutf8(fmt)
+
+    @_assumes_file_open
+    def write_header(self, num_tests: int, num_items: int,
+                     max_num_answers: int,
+                     dont_know_included: bool) -> None:
+        if self.header is not None:
+            raise GabWriterError("Cabeçalho já foi escrito!")
+        for name, x in (('num_tests', num_tests),
+                        ('num_items', num_items),
+                        ('max_num_answers', max_num_answers)):
+            if not (x > 0):
+                raise GabWriterError(f"{name}={x} deveria ser positivo.")
+        self._write_int(num_tests)
+        self._write_int(num_items)
+        self._write_int(max_num_answers)
+        self._write_bool(dont_know_included)
+        self.header = (num_tests, num_items, max_num_answers,
+                       dont_know_included)
+
+    @_assumes_file_open
+    def _write_student_data(self, st: Optional[_GabReader.Student]):
+        if st is None:
+            # Prova sem nome: todos os campos em branco (mas a string
+            # não pode ser vazia)
+            self._write_mutf8(' ' + ',' * (self.num_fields or 0))
+            return
+        fields = [st.nome] + list(st.fields)
+        if not all(f and f == f.strip() and ',' not in f
+                   for f in fields):
+            raise GabWriterError(f"Campos inválidos: {st}")
+        self._write_mutf8(','.join(fields))
+
+    @_assumes_file_open
+    def _write_item(self, item: _GabReader.MCItem) -> None:
+        _, _, _, dki = self.header
+        if item.num_answers != len(item.perm) + dki:
+            raise GabWriterError(
+                f"Quantidade de respostas inválida: {item}")
+        if item.right_orig != 0 or item.perm[item.right] != 0:
+            raise GabWriterError(f"Resposta certa inválida: {item}")
+        self._write_permutation(item.perm)
+        self._write_int(item.right)
+        self._write_int(item.num_answers)
+        self._write_int(item.num_orig)
+        self._write_int(item.right_orig)
+        self._write_int(item.right ^ item.num_answers ^ item.num_orig
+                        ^ item.right_orig)
+
+    @_assumes_file_open
+    def write_test(self, t: _GabReader.MCTest) -> None:
+        if self.header is None:
+            raise GabWriterError("Cabeçalho ainda não foi escrito!")
+        if self.num_written == self.header[0]:
+            raise GabWriterError("Testes demais para o cabeçalho.")
+        if t.st is not None:
+            if self.seen_unnamed:
+                raise GabWriterError(
+                    f"Teste com nome após teste sem nome: {t.st}")
+            if self.num_fields is None:
+                self.num_fields = len(t.st.fields)
+            elif len(t.st.fields) != self.num_fields:
+                raise GabWriterError(
+                    f"Teste com quantidade inválida de campos: {t.st}")
+        else:
+            self.seen_unnamed = True
+        if len(t.items) != len(t.perm):
+            raise GabWriterError(
+                f"Teste com {len(t.items)} itens e permutação {t.perm}")
+        self._write_permutation(t.perm)
+        self._write_student_data(t.st)
+        for j, item in zip(t.perm, t.items):
+            if item.num_orig != j:
+                raise GabWriterError(
+                    f"Permutação dos itens {t.perm} em desacordo com o "
+                    f"campo num_orig do {j}-ésimo item: {item}.")
+            if self.num_ans_orig.setdefault(j, item.num_answers) \
+                    != item.num_answers:
+                raise GabWriterError(
+                    f"Teste com quantidade inválida de respostas em "
+                    f"cada item: {t.items}.")
+            self._write_item(item)
+        self.num_written += 1
+
+    @_assumes_file_open
+    def assert_complete(self) -> None:
+        if self.header is None or self.num_written != self.header[0]:
+            raise GabWriterError(
+                f"Foram escritos {self.num_written} testes, mas o "
+                f"cabeçalho diz {self.header and self.header[0]}.")
+
+    ###
+    ### Context manager:
+    ###
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path).resolve()
+        self.file = None
+        self.header = None
+        self.num_written = 0
+        self.num_fields = None
+        self.num_ans_orig = {}
+        self.seen_unnamed = False
+
+    def __enter__(self):
+        self.file = self.path.open('wb')
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if self.is_open():
+            self.close()
+
+    def has_valid_handle(self):
+        return self.file is not None
+
+    def is_open(self):
+        return self.has_valid_handle() and not self.file.closed
+
+    def close(self):
+        assert self.has_valid_handle()
+        assert self.is_open()
+        self.file.close()
+
+
 MCTest = _GabReader.MCTest
 MCKey = _GabReader.MCKey
 MCItem = _GabReader.MCItem
@@ -3,15 +3,24 @@
 
 from __future__ import annotations
 
+import os
+import csv
 import sys
+import json
+import hashlib
 import pathlib
 import argparse
 import collections
-from typing import List
+import multiprocessing
+import concurrent.futures
+from typing import List, NamedTuple, Optional, Tuple
 
-import pandas as pd
+import numpy as np
 
+import report
+import instrument
 from gab import Gab, MCTest, MCKey
+from tabela import Tabela
 
 assert sys.version_info >= (3, 8)
 
@@ -55,10 +64,6 @@ def error(txt):
           file=sys.stderr)
 
 
-def index_of_last(lst: list, x) -> int:
-    return len(lst) - list(reversed(lst)).index(x) - 1
-
-
 log_options = [
     'noshow',
     'one_attempt',
@@ -66,8 +71,12 @@ log_options = [
     'no_positive_attempts',
     'one_positive_attempt',
     'lastpos_atmost2_nonpos',
+    'manual',  # tentativa escolhida no arquivo de --override
 ]
 
+# Casos avisados no stdout por default (ver --log)
+DEFAULT_LOG = {'lastpos_atmost2_nonpos'}
+
 
 # TODO: essa classe está uma bagunça. Esse tipo de abstração deveria
 #       ser feito de forma mais unificada com o gab.py.
@@ -78,15 +87,16 @@ class Respostas:
 
     last_is_dk = True  # TODO: deveria ser parametrizável
 
+    # TODO: usar Unicode NCF para tirar os acentos, e comparar as
+    #       strings sem acento.
+    DK_STRINGS = ["não sei.", "nâo sei.", "não sei", "não sei\xA0"]
+
     @staticmethod
     def item_from_str(s: str, N: int) -> str:
         # s: "(a)" ou "(b)" ou ... ou "Não sei."
         # N: quantidade de itens possíveis, sem contar o "Não sei."
 
-        # TODO: usar Unicode NCF para tirar os acentos, e comparar as
-        #       strings sem acento.
-        if s.lower() in ["não sei.", "nâo sei.", "não sei",
-                         "não sei\xA0"]:
+        if s.lower() in Respostas.DK_STRINGS:
             return '.'
         elif (
             isinstance(s, str)
@@ -113,13 +123,6 @@ class Respostas:
         self._l = tuple(self.item_from_str(s, N)
                         for s, N in zip(lst, num_ans))
 
-    @classmethod
-    def from_row(cls, row: pd.Series, num_ans: List[int]):
-        resp_headers = []
-        while (h := f'Resposta {len(resp_headers) + 1}') in row.index:
-            resp_headers.append(h)
-        return cls(row[resp_headers], num_ans)
-
     def __str__(self):
         result = ""
         for x in self._l:
@@ -269,6 +272,631 @@ def read_check_test_from_row(g, row):
     return t
 
 
+class Attempts(NamedTuple):
+    """Classificação das tentativas de todos os alunos da pauta (ver
+    classify_attempts)."""
+    # Um valor por aluno da pauta (na ordem da pauta). O status é None
+    # para os alunos cujo padrão de tentativas não cai em nenhum dos
+    # casos tratados, e `attempt' é a posição (em `answers') da
+    # tentativa que será considerada, ou -1 se não houver.
+    status: np.ndarray
+    attempt: np.ndarray
+    num_attempts: np.ndarray
+    num_empty: np.ndarray
+    last_positive_count: np.ndarray
+    # As colunas "Resposta N" de cada tentativa (na ordem do
+    # RESPOSTAS_CSV), e o aluno (posição na pauta) de cada uma.
+    answers: np.ndarray
+    student: np.ndarray
+
+
+def _attempt_flags(answers: np.ndarray, num_ans: np.ndarray):
+    """Calcula, de uma vez para todas as tentativas, quais respostas
+    são em branco ('-') e quais são afirmativas. `num_ans' tem o
+    número de opções (contando o "Não sei.") de cada questão da prova
+    do aluno de cada tentativa. Mesmas validações do
+    Respostas.item_from_str."""
+    strs = answers.astype(str, order='C')
+    if strs.dtype.itemsize // 4 < 3:
+        strs = strs.astype('U3', order='C')
+    # Uma matriz (tentativa, questão, caractere) de code points
+    chars = strs.view(np.uint32).reshape(
+        strs.shape + (strs.dtype.itemsize // 4,))
+    blank = strs == '-'
+    dont_know = np.isin(np.char.lower(strs), Respostas.DK_STRINGS)
+    letter = (
+        (np.char.str_len(strs) == 3)
+        & (chars[..., 0] == ord('('))
+        & (chars[..., 2] == ord(')'))
+    )
+    x = chars[..., 1].astype(np.int64) - ord('a')
+
+    invalid = ~(blank | dont_know | letter)
+    if invalid.any():
+        s = str(answers[invalid][0])
+        raise ValueError(f"Resposta inválida: '{s}' ({s.encode()})")
+    invalid = letter & (x >= num_ans)
+    if invalid.any():
+        raise ValueError(f"Resposta inválida: {answers[invalid][0]}.")
+
+    positive = letter & (x >= 0) & (x < num_ans - 1)
+    return blank, positive
+
+
+def classify_attempts(emails, respostas: Tabela,
+                      num_ans: np.ndarray) -> Attempts:
+    """Decide, para todos os alunos de uma vez, qual das tentativas
+    será levada em consideração.
+
+    `emails' são os emails dos alunos da pauta, e `num_ans' é a matriz
+    (aluno, questão) com o número de opções de cada questão da prova
+    de cada aluno. As flags de cada tentativa são calculadas numa
+    passada só, e depois reduzidas por aluno.
+    """
+    num_items = num_ans.shape[1]
+    resp_headers = []
+    while (h := f'Resposta {len(resp_headers) + 1}') in respostas:
+        resp_headers.append(h)
+    resp_headers = resp_headers[:num_items]
+
+    # Só interessam as tentativas dos alunos da pauta. Se um email
+    # aparece mais de uma vez na pauta, as tentativas são de todos.
+    first = {}  # email -> posição do primeiro aluno com esse email
+    for s, email in enumerate(emails):
+        first.setdefault(email, s)
+    code_of = {email: k for k, email in enumerate(first)}
+    codes = np.array([code_of[email] for email in emails],
+                     dtype=np.int64)
+    attempt_code = np.array(
+        [code_of.get(email, -1)
+         for email in respostas['Endereço de email']],
+        dtype=np.int64)
+    mask = attempt_code >= 0
+    attempt_code = attempt_code[mask]
+    answers = np.empty((len(respostas), len(resp_headers)), dtype=object)
+    for j, h in enumerate(resp_headers):
+        answers[:, j] = respostas[h]
+    answers = answers[mask]
+    first_student = np.array(list(first.values()), dtype=np.int64)
+    student = first_student[attempt_code]
+
+    blank, positive_item = _attempt_flags(
+        answers, num_ans[student, :len(resp_headers)])
+    empty = blank.all(axis=1)
+    positive_count = positive_item.sum(axis=1)
+    positive = positive_count > 0
+
+    # Reduções por aluno (as tentativas estão na ordem do CSV)
+    n = len(first)
+    pos = np.arange(len(answers))
+    num_attempts = np.bincount(attempt_code, minlength=n)
+    num_nonempty = np.bincount(attempt_code[~empty], minlength=n)
+    num_positive = np.bincount(attempt_code[positive], minlength=n)
+    last = np.full(n, -1)
+    np.maximum.at(last, attempt_code, pos)
+    last_nonempty = np.full(n, -1)
+    np.maximum.at(last_nonempty, attempt_code[~empty], pos[~empty])
+    last_positive = np.full(n, -1)
+    np.maximum.at(last_positive, attempt_code[positive],
+                  pos[positive])
+    # (o -1 de quem não tem tentativa positiva cai no 0 do final)
+    last_positive_count = np.append(positive_count, 0)[last_positive]
+
+    conditions = [
+        num_attempts == 0,
+        num_attempts == 1,
+        num_nonempty == 0,
+        num_positive == 0,
+        num_positive == 1,
+        # se o último (entre os positivos) tem no máx. 2 entradas
+        # não-positivas, fica com ele
+        last_positive_count >= len(resp_headers) - 2,
+    ]
+    case = np.select(conditions, range(len(conditions)), default=-1)
+    status = np.array(log_options[:len(conditions)] + [None],
+                      dtype=object)[case]
+    # noshow fica sem tentativa; only_empty_attempts fica com a última
+    # (vazia); no_positive_attempts com a última não-vazia; e os casos
+    # com tentativa positiva, com a última positiva.
+    attempt = np.select(
+        conditions,
+        [-1, last, last, last_nonempty, last_positive, last_positive],
+        default=-1)
+
+    return Attempts(
+        status=status[codes],
+        attempt=attempt[codes],
+        num_attempts=num_attempts[codes],
+        num_empty=(num_attempts - num_nonempty)[codes],
+        last_positive_count=last_positive_count[codes],
+        answers=answers,
+        student=student,
+    )
+
+
+# Colunas do RESPOSTAS_CSV que identificam o aluno (e a nota do
+# moodle), e que não precisam aparecer junto das tentativas.
+_ID_COLUMNS = ['Sobrenome', 'Nome', 'Endereço de email', 'Avaliar/10,00']
+
+
+def student_attempts(respostas: Tabela, email) -> Tuple[List[str], list]:
+    """As tentativas de `email' no RESPOSTAS_CSV (na ordem do arquivo):
+    retorna (nomes das colunas, lista de linhas), sem as _ID_COLUMNS."""
+    cols = [c for c in respostas.columns if c not in _ID_COLUMNS]
+    rows = [
+        [respostas[c][k] for c in cols]
+        for k, e in enumerate(respostas['Endereço de email'])
+        if e == email
+    ]
+    return cols, rows
+
+
+def unhandled_error(pauta: Tabela, respostas: Tabela,
+                    unhandled: np.ndarray,
+                    incremental=None) -> NotImplementedError:
+    """O erro com as tentativas de todos os alunos (posições
+    `unhandled' na pauta) que não caem em nenhum dos casos tratados
+    por este script. `incremental' é o STATE_JSON do --incremental, se
+    houver: a dica no final depende do modo."""
+    blocos = []
+    for row in pauta.itertuples(unhandled):
+        stringid_aluno = f"{row.nomecompleto} <{row.email}> ({row.dre})"
+        cols, rows = student_attempts(respostas, row.email)
+        linhas = [f"    {' | '.join(cols)}"] + [
+            f"{k:>2}) {' | '.join(str(x or '') for x in values)}"
+            for k, values in enumerate(rows, start=1)
+        ]
+        blocos.append(f"    {stringid_aluno}\n\n"
+                      f"Estas foram as {len(rows)} tentativas:\n\n"
+                      + "\n".join(linhas) + "\n\n")
+    if incremental is None:
+        rodar_de_novo = ("rodando com --reuse para não corrigir tudo "
+                         "de novo")
+    else:
+        rodar_de_novo = (f"rodando com o mesmo --incremental "
+                         f"{incremental}, que só corrige de novo estes "
+                         f"alunos")
+    return NotImplementedError(
+        f"Você está encontrando este erro porque os seguintes "
+        f"{len(blocos)} aluno(s) submeteram um padrão de tentativas "
+        f"que não cai em nenhum dos casos testados por este "
+        f"script:\n\n" + "".join(blocos) +
+        f"1) Dê uma olhada no código para ver quais casos são "
+        f"contemplados;\n"
+        f"2) Descubra (talvez perguntando para o aluno) o que "
+        f"exatamente aconteceu, e qual das tentativas que ele "
+        f"submeteu deve ser levada em consideração;\n"
+        f"3) Adapte o código para levar em consideração o caso do "
+        f"aluno, e Tente Outra Vez.\n\n"
+        f"Ou então: rode com --partial para corrigir os outros "
+        f"alunos, e depois informe a tentativa de cada um destes num "
+        f"arquivo de --override ({rodar_de_novo})."
+    )
+
+
+def write_review_file(path, pauta: Tabela, respostas: Tabela,
+                      unhandled: np.ndarray):
+    """Salva as tentativas dos alunos não tratados (posições
+    `unhandled' na pauta) num CSV, numeradas a partir de 1 na ordem
+    do RESPOSTAS_CSV. O número da tentativa é o que deve ser usado no
+    arquivo de --override."""
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file, lineterminator=os.linesep)
+        for n, row in enumerate(pauta.itertuples(unhandled)):
+            cols, rows = student_attempts(respostas, row.email)
+            if n == 0:
+                writer.writerow(['numeracao', 'nomecompleto', 'email',
+                                 'tentativa'] + cols)
+            for k, values in enumerate(rows, start=1):
+                writer.writerow(
+                    [row.Index, row.nomecompleto, row.email, k]
+                    + ['' if x is None else x for x in values])
+
+
+def read_overrides(path) -> dict:
+    """Lê o arquivo de --override: um CSV com as colunas `email' e
+    `tentativa', onde `tentativa' é o número (a partir de 1, na ordem
+    do RESPOSTAS_CSV, como no arquivo de revisão) da tentativa que
+    deve ser considerada, ou 0 para nenhuma (nota zero)."""
+    df = Tabela.read_csv(path)
+    if not {'email', 'tentativa'} <= set(df.columns):
+        raise ValueError(
+            f"{path}: o arquivo deve ter as colunas 'email' e "
+            f"'tentativa'.")
+    overrides = {}
+    for email, k in zip(df['email'], df['tentativa']):
+        if email in overrides:
+            raise ValueError(f"{path}: email repetido: {email}")
+        overrides[email] = int(k)
+    return overrides
+
+
+def apply_overrides(attempts: Attempts, emails: np.ndarray,
+                    overrides: dict):
+    """Marca como 'manual' os alunos do arquivo de --override, com a
+    tentativa escolhida lá (altera `attempts')."""
+    for email, k in overrides.items():
+        students = np.flatnonzero(emails == email)
+        if len(students) == 0:
+            raise ValueError(f"Override para email fora da pauta: "
+                             f"{email}")
+        own = np.flatnonzero(attempts.student == students[0])
+        if not 0 <= k <= len(own):
+            raise ValueError(
+                f"Override para {email}: tentativa {k}, mas o aluno "
+                f"submeteu {len(own)}.")
+        attempts.status[students] = 'manual'
+        attempts.attempt[students] = own[k - 1] if k > 0 else -1
+
+
+# Colunas que o grade.py preenche na pauta
+RESULT_COLUMNS = ['status', 'perm', 'respostas', 'gabarito', 'nota']
+
+
+def reusable_results(pauta: Tabela, path, skip: np.ndarray) -> dict:
+    """Lê um pauta_com_notas.csv de uma rodada anterior, e devolve as
+    linhas que podem ser aproveitadas: as que têm status, são do mesmo
+    aluno (mesmo email na mesma numeração) e não estão em `skip'.
+
+    Retorna um dict posição na pauta -> {coluna: valor}, com as
+    RESULT_COLUMNS."""
+    prev = Tabela.read_csv(path, index_col='numeracao')
+    prev_pos = {n: k for k, n in enumerate(prev.index)}
+    result = {}
+    for i, (n, email) in enumerate(zip(pauta.index, pauta['email'])):
+        k = prev_pos.get(n)
+        if (k is None or skip[i] or prev['status'][k] is None
+                or prev['email'][k] != email):
+            continue
+        result[i] = {col: prev[col][k] for col in RESULT_COLUMNS}
+        nota = result[i]['nota']
+        result[i]['nota'] = float('NaN') if nota is None else float(nota)
+    return result
+
+
+def grade_student(row, test: MCTest, attempts: Attempts, i: int,
+                  g: Gab, log) -> Tuple[dict, List[str]]:
+    """Dá a nota do i-ésimo aluno da pauta, na tentativa escolhida
+    pelo classify_attempts.
+
+    `row' é a linha do aluno na pauta (do pauta.itertuples()).
+    Retorna o dict com as colunas da pauta a serem preenchidas, e as
+    mensagens de log (que devem ser impressas na ordem da pauta).
+    """
+    mensagens = []
+    stringid_aluno = f"{row.nomecompleto} <{row.email}> ({row.dre})"
+    status = attempts.status[i]
+    num_tentativas = attempts.num_attempts[i]
+    resultado = {'perm': test.perm.to_csv_string(), 'status': status}
+
+    if status in log:
+        if status == 'noshow':
+            msg = f"Aluno não fez a prova: {stringid_aluno}"
+        elif status == 'one_attempt':
+            msg = f"Exatamente uma tentativa: {stringid_aluno}"
+        elif status == 'only_empty_attempts':
+            msg = (f"Submeteu {num_tentativas} tentativas, todas "
+                   f"vazias: {stringid_aluno}")
+        elif status == 'no_positive_attempts':
+            msg = (f"Submeteu {num_tentativas} tentativas, "
+                   f"{attempts.num_empty[i]} vazia(s), e "
+                   f"nenhuma positiva: {stringid_aluno}")
+        elif status == 'one_positive_attempt':
+            msg = (f"Submeteu {num_tentativas} tentativas, exatamente "
+                   f"uma delas positiva: {stringid_aluno}")
+        elif status == 'manual':
+            msg = (f"Submeteu {num_tentativas} tentativas, escolhida "
+                   f"no --override: {stringid_aluno}")
+        else:
+            assert status == 'lastpos_atmost2_nonpos'
+            msg = (f"Submeteu {num_tentativas} tentativas, a última "
+                   f"positiva com "
+                   f"{attempts.last_positive_count[i]:>2} itens: "
+                   f"{stringid_aluno}")
+        mensagens.append(f"* {msg}")
+
+    if status == 'noshow':
+        return resultado, mensagens  # mantém resposta=None e nota=NaN
+    if attempts.attempt[i] < 0:
+        # --override com "tentativa 0": nenhuma tentativa vale
+        resultado['nota'] = 0.0
+        return resultado, mensagens
+
+    num_ans_list = [it.num_answers for it in test.items]
+    resultado['respostas'] = Respostas(
+        attempts.answers[attempts.attempt[i]], num_ans_list)
+    if status in ('only_empty_attempts', 'no_positive_attempts'):
+        # salva como "resposta" a última tentativa (não-vazia, se
+        # houver), com nota zero.
+        resultado['nota'] = 0.0
+    else:
+        nota, gabarito = resultado['respostas'].grade(test, g.keys)
+        resultado['nota'] = nota
+        resultado['gabarito'] = gabarito
+    return resultado, mensagens
+
+
+def grade_student_safe(row, test: MCTest, attempts: Attempts, i: int,
+                       g: Gab, log):
+    """Chama o grade_student, e retorna (posição na pauta, resultado,
+    mensagens, exceção). Se der erro, o erro é retornado ao invés de
+    levantado, para que quem chamou possa levantá-lo na ordem certa
+    (depois das mensagens dos alunos anteriores)."""
+    try:
+        resultado, mensagens = grade_student(row, test, attempts, i,
+                                             g, log)
+    except Exception as e:
+        return i, None, [], e
+    return i, resultado, mensagens, None
+
+
+# Estado compartilhado com os processos do grade_parallel. Com o
+# start method 'fork', os processos herdam esses objetos sem copiá-los.
+_worker_state = None
+
+
+def _init_worker(state):
+    global _worker_state
+    _worker_state = state
+
+
+def _grade_chunk(positions):
+    pauta, tests, attempts, g, log = _worker_state
+    return [grade_student_safe(row, tests[i], attempts, i, g, log)
+            for i, row in zip(positions, pauta.itertuples(positions))]
+
+
+def grade_parallel(pauta, positions, tests, attempts: Attempts, g: Gab,
+                   log, jobs: int):
+    """Como o loop serial de grade_student_safe (sobre os alunos nas
+    posições `positions' da pauta), mas dividido entre `jobs'
+    processos. Os resultados são devolvidos na ordem da pauta."""
+    try:
+        mp_context = multiprocessing.get_context('fork')
+    except ValueError:
+        mp_context = None  # e.g. Windows: o estado é copiado (pickle)
+    num_chunks = max(min(len(positions), 4 * jobs), 1)
+    bounds = [len(positions) * k // num_chunks
+              for k in range(num_chunks + 1)]
+    chunks = [positions[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+    with concurrent.futures.ProcessPoolExecutor(
+            jobs, mp_context=mp_context, initializer=_init_worker,
+            initargs=((pauta, tests, attempts, g, log),),
+    ) as executor:
+        for resultados in executor.map(_grade_chunk, chunks):
+            yield from resultados
+
+
+def read_gabs(paths, adendos=(), jobs: int = 1, lazy: bool = False,
+              index_path=None) -> Gab:
+    """Lê o(s) gabarito(s) (juntando-os, se houver mais de um) e aplica
+    os adendos, mostrando as chaves alteradas por eles.
+
+    Se `lazy' e o gabarito for um único .gab, os testes não são lidos
+    agora: o de cada aluno é lido do arquivo (pelo índice, ver
+    gab.GabIndex, salvo em `index_path') quando for pedido. Vale a
+    pena quando só alguns alunos vão ser corrigidos.
+    """
+    instrument.begin('ler_gabaritos')
+    if (lazy and len(paths) == 1
+            and pathlib.Path(paths[0]).suffix == '.gab'):
+        g = Gab.lazy_from_gab_file(paths[0], verbose=True, index=True,
+                                   index_path=index_path)
+    else:
+        gabs = [Gab.from_file(path, verbose=True, jobs=jobs)
+                for path in paths]
+        if len(gabs) == 1:
+            g = gabs[0]
+        else:
+            g = Gab.merge(gabs, verbose=True)
+        del gabs
+    instrument.end()
+    with instrument.stage('adendos'):
+        diff = g.update_from_addenda(adendos, verbose=True)
+    if diff:
+        print("    Chaves alteradas pelos adendos:")
+        item_width = len(str(g.num_items))
+        for item, antes, depois in diff:
+            print(f"      . {item + 1:>{item_width}}: "
+                  f"{antes or '-'} -> {depois or '-'}")
+    return g
+
+
+def print_stats(pauta: Tabela, overrides: Optional[dict] = None):
+    """Mostra quantos alunos da pauta caíram em cada status."""
+    print(f"Stats: (total {len(pauta)})")
+    status_count = collections.Counter(pauta['status'])
+    total_count = 0
+    for opt in log_options:
+        count = status_count[opt]
+        if opt == 'manual' and overrides is None and count == 0:
+            continue  # sem --override, a saída fica como era antes
+        print(f"  > {opt}: {count}")
+        total_count += count
+    na_count = status_count[None]
+    if na_count > 0:
+        print(f"  > (sem status): {na_count}")
+    assert total_count + na_count == len(pauta)
+
+
+def grade_pauta(pauta: Tabela, respostas: Tabela, g: Gab, log=(),
+                jobs: int = 1, overrides: Optional[dict] = None,
+                reuse=None, partial: bool = False,
+                review_file='tentativas_para_revisar.csv',
+                incremental=None):
+    """Dá as notas de todos os alunos da pauta, preenchendo (em
+    `pauta') as RESULT_COLUMNS, e mostra as estatísticas no final. As
+    opções são as de mesmo nome na linha de comando; `overrides' é o
+    dict lido com `read_overrides'.
+
+    Com `incremental', a pauta é só a dos alunos a corrigir de novo:
+    as estatísticas ficam para quem junta o resultado com o resto."""
+    for col in RESULT_COLUMNS:
+        pauta[col] = [None] * len(pauta)
+    pauta['nota'] = [float('NaN')] * len(pauta)
+
+    # A prova de cada aluno, e quantas opções tem cada questão
+    instrument.begin('provas_dos_alunos')
+    tests = [read_check_test_from_row(g, row)
+             for row in pauta.itertuples()]
+    num_ans = np.array([[it.num_answers for it in t.items]
+                        for t in tests], dtype=np.int64)
+    num_ans = num_ans.reshape(len(tests), g.num_items)
+    instrument.end()
+
+    # Classifica as tentativas de todos os alunos de uma vez
+    instrument.begin('classificar_tentativas')
+    emails = np.array(pauta['email'], dtype=object)
+    attempts = classify_attempts(emails, respostas, num_ans)
+    instrument.count('tentativas_lidas', len(attempts.answers))
+
+    # Decisões manuais sobre qual tentativa considerar
+    overridden = np.zeros(len(pauta), dtype=bool)
+    if overrides:
+        apply_overrides(attempts, emails, overrides)
+        overridden = np.isin(emails, list(overrides))
+
+    # Alunos já corrigidos numa rodada anterior
+    reused = np.zeros(len(pauta), dtype=bool)
+    if reuse is not None:
+        prev = reusable_results(pauta, reuse, overridden)
+        for i, resultado in prev.items():
+            reused[i] = True
+            for col, val in resultado.items():
+                pauta[col][i] = val
+        print(f"Aproveitando {reused.sum()} aluno(s) de {reuse}")
+
+    unhandled = np.flatnonzero(np.equal(attempts.status, None)
+                               & ~reused)
+    instrument.count('alunos_nao_tratados', len(unhandled))
+    instrument.end()
+    if len(unhandled) > 0:
+        if not partial:
+            raise unhandled_error(pauta, respostas, unhandled,
+                                  incremental)
+        write_review_file(review_file, pauta, respostas,
+                          unhandled)
+        warn(f"{len(unhandled)} aluno(s) com padrão de tentativas não "
+             f"tratado ficaram sem nota; as tentativas deles estão em "
+             f"{review_file}")
+        for i in unhandled:
+            pauta['perm'][i] = tests[i].perm.to_csv_string()
+
+    todo = np.flatnonzero(np.not_equal(attempts.status, None)
+                          & ~reused)
+    instrument.count('alunos_corrigidos', len(todo))
+    instrument.begin('corrigir')
+    if jobs > 1:
+        resultados = grade_parallel(pauta, todo, tests, attempts, g,
+                                    log, jobs)
+    else:
+        resultados = (
+            grade_student_safe(row, tests[i], attempts, i, g, log)
+            for i, row in zip(todo, pauta.itertuples(todo)))
+
+    for i, resultado, mensagens, erro in resultados:
+        for msg in mensagens:
+            print(msg)
+        if erro is not None:
+            raise erro
+        for col, val in resultado.items():
+            pauta[col][i] = val
+    instrument.end()
+
+    na_count = sum(status is None for status in pauta['status'])
+    assert na_count == len(unhandled)
+    if incremental is None:
+        print_stats(pauta, overrides)
+
+
+###
+### Modo --incremental: só corrige de novo os alunos cujas tentativas
+### (ou a linha na pauta) mudaram desde a última execução.
+###
+
+# Versão do formato do arquivo de estado do --incremental
+INCREMENTAL_VERSION = 2
+
+
+def file_sha256(path) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for bloco in iter(lambda: file.read(1 << 20), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def inputs_fingerprint(paths, respostas: Tabela) -> str:
+    """Impressão digital (hash) do que vale para todos os alunos: o
+    conteúdo dos arquivos `paths' (gabaritos e adendos) e as colunas do
+    RESPOSTAS_CSV. Se ela mudar, todos são corrigidos."""
+    data = [[os.fspath(p), file_sha256(p)] for p in paths]
+    data.append(respostas.columns)
+    return hashlib.sha256(json.dumps(data).encode()).hexdigest()
+
+
+def attempt_fingerprints(pauta: Tabela, respostas: Tabela,
+                         overrides: Optional[dict] = None) -> List[str]:
+    """Impressão digital (hash) de cada aluno da pauta, que muda se
+    mudar a linha dele na pauta, qualquer uma das tentativas dele (ou
+    a ordem delas) no RESPOSTAS_CSV, ou a linha dele no --override."""
+    overrides = overrides or {}
+    rows = collections.defaultdict(list)
+    for email, row in zip(respostas['Endereço de email'],
+                          zip(*respostas.colunas.values())):
+        rows[email].append(row)
+    # (os valores são str ou None, e o repr deles é estável)
+    return [
+        hashlib.sha256(
+            repr((tuple(row), rows.get(row.email, []),
+                  overrides.get(row.email, ''))).encode()
+        ).hexdigest()
+        for row in pauta.itertuples()
+    ]
+
+
+def unchanged_students(state_path, inputs_key: str, pauta: Tabela,
+                       fingerprints: List[str], results_path):
+    """Quais alunos da pauta (máscara) estão iguais a como estavam na
+    execução que salvou o arquivo de estado, desde que os resultados
+    dela (`results_path') não tenham sido alterados."""
+    unchanged = np.zeros(len(pauta), dtype=bool)
+    try:
+        with open(state_path) as file:
+            state = json.load(file)
+    except FileNotFoundError:
+        return unchanged
+    if (state.get('versao') != INCREMENTAL_VERSION
+            or state['entradas'] != inputs_key
+            or not pathlib.Path(results_path).exists()
+            or state['resultados'] != file_sha256(results_path)):
+        return unchanged
+    alunos = state['alunos']
+    for i, (n, fp) in enumerate(zip(pauta.index, fingerprints)):
+        unchanged[i] = alunos.get(str(n)) == fp
+    return unchanged
+
+
+def write_incremental_state(state_path, inputs_key: str, pauta: Tabela,
+                            fingerprints: List[str], results_path):
+    """Salva o arquivo de estado. Os alunos sem status (não tratados,
+    com --partial) ficam de fora, para serem tentados de novo."""
+    alunos = {
+        str(n): fp
+        for n, fp, status in zip(pauta.index, fingerprints,
+                                 pauta['status'])
+        if status is not None
+    }
+    with open(state_path, 'w') as file:
+        json.dump({
+            'versao': INCREMENTAL_VERSION,
+            'entradas': inputs_key,
+            'resultados': file_sha256(results_path),
+            'alunos': alunos,
+        }, file, indent=1)
+        file.write('\n')
+
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(
@@ -302,8 +930,11 @@ if __name__ == "__main__":
         "GABARITO",
         help="Arquivo '.gab' que foi gerado pelo AtenaME junto do lote "
              "de provas, ou então o '.zip' contendo o gab. Se for "
-             "passado o zip, lemos também o '.adg' se houver.",
+             "passado o zip, lemos também o '.adg' se houver. Se a "
+             "prova foi gerada em vários lotes, passe os gabaritos de "
+             "todos os lotes, e eles serão juntados num só.",
         type=pathlib.Path,
+        nargs='+',
     )
 
     parser.add_argument(
@@ -321,198 +952,190 @@ if __name__ == "__main__":
     )
 
     parser.add_argument(
-        "--log", "++log", choices=log_options,
-        default={'lastpos_atmost2_nonpos'},
-        action=UpdateSetAction,
-        help="Quais casos avisar no stdout (ao invés de processar "
-             "em silêncio)",
+        "--jobs", "-j",
+        help="Quantidade de processos usados para ler o gabarito e "
+             "corrigir as provas. O default é 1 (sem paralelismo).",
+        type=int,
+        default=1,
     )
 
-    args = parser.parse_args()
-
-    init()  # Inicializa as cores
-
-    ###
-    ### Ler as respostas dos alunos, e decidir qual das "tentativas"
-    ### será levada em consideração.
-    ###
+    parser.add_argument(
+        "--partial",
+        help="Se houver alunos com um padrão de tentativas que não cai "
+             "em nenhum dos casos tratados, ao invés de dar erro, dá "
+             "nota para os outros, deixa esses sem status e sem nota "
+             "e salva as tentativas deles em REVIEW_CSV (default: "
+             "tentativas_para_revisar.csv), para serem decididas no "
+             "--override.",
+        action='store_true',
+    )
 
-    respostas = pd.read_csv(args.RESPOSTAS_CSV)
-
-    pauta = pd.read_csv(args.PAUTA_CSV, index_col='numeracao',
-                        dtype={
-                            'chamada': 'string',
-                            'email': 'string',
-                            'dre': 'string',
-                            'nomecompleto': 'string',
-                        })
-    pauta['status'] = None
-    pauta['status'] = pd.Series(pauta['status'], dtype='string')
-    pauta['perm'] = None
-    pauta['perm'] = pd.Series(pauta['perm'], dtype='string')
-    pauta['respostas'] = None
-    pauta['gabarito'] = None
-    pauta['gabarito'] = pd.Series(pauta['gabarito'], dtype='string')
-    pauta['nota'] = float('NaN')
-
-    # Lê o gabarito e os adendos
-    if args.GABARITO.suffix == '.gab':
-        g = Gab.from_gab_file(args.GABARITO, verbose=True)
-    elif args.GABARITO.suffix == '.zip':
-        g = Gab.from_zip_file(args.GABARITO, verbose=True)
-    else:
-        raise ValueError(
-            f"Formato {args.GABARITO.suffix} não reconhecido.")
-    for adg_path in args.adendos:
-        g.update_from_addendum(adg_path, verbose=True)
+    parser.add_argument(
+        "--review-file",
+        help="Onde o --partial salva as tentativas a revisar.",
+        type=pathlib.Path,
+        metavar='REVIEW_CSV',
+        default=pathlib.Path('tentativas_para_revisar.csv'),
+    )
 
-    for row in pauta.itertuples():
-        # todas as tentativas do aluno
-        subdf = respostas[respostas['Endereço de email'] == row.email]
-        stringid_aluno = f"{row.nomecompleto} <{row.email}> ({row.dre})"
-        test = read_check_test_from_row(g, row)
-        pauta.at[row.Index, 'perm'] = test.perm.to_csv_string()
-        num_ans_list = [it.num_answers for it in test.items]
-
-        if len(subdf) == 0:
-            # Nenhuma tentativa submetiva
-            status = 'noshow'
-            if status in args.log:
-                print(f"* Aluno não fez a prova: {stringid_aluno}")
-            pauta.at[row.Index, 'status'] = status
-            continue  # mantém resposta=None e nota=NaN
-
-        # Aqui, o aluno submeteu pelo menos uma tentativa
-
-        if len(subdf) == 1:
-            # Somente uma tentativa
-            status = 'one_attempt'
-            if status in args.log:
-                print(f"* Exatamente uma tentativa: {stringid_aluno}")
-            pauta.at[row.Index, 'status'] = status
-            pauta.at[row.Index, 'respostas'] = \
-                Respostas.from_row(subdf.iloc[0], num_ans_list)
-            nota, gabarito = pauta.at[row.Index, 'respostas'].grade(
-                test, g.keys)
-            pauta.at[row.Index, 'nota'] = nota
-            pauta.at[row.Index, 'gabarito'] = gabarito
-            continue
+    parser.add_argument(
+        "--override",
+        help="CSV com as colunas 'email' e 'tentativa', dizendo qual "
+             "tentativa (numerada a partir de 1, como no REVIEW_CSV; 0 "
+             "para nenhuma, com nota zero) considerar para cada aluno "
+             "listado, independentemente dos casos tratados pelo "
+             "script.",
+        type=pathlib.Path,
+        metavar='OVERRIDE_CSV',
+    )
 
-        # len(subdf) >= 2, ou seja, o aluno submeteu pelo menos 2
-        # tentativas
-
-        tentativas = [Respostas.from_row(r, num_ans_list)
-                      for _, r in subdf.iterrows()]
-
-        nonempty_mask = [not r.is_empty() for r in tentativas]
-        if sum(nonempty_mask) == 0:
-            # Todos os attempts estão vazios
-            status = 'only_empty_attempts'
-            if status in args.log:
-                print(f"* Submeteu {len(subdf)} tentativas, todas "
-                      f"vazias: {stringid_aluno}")
-            pauta.at[row.Index, 'status'] = status
-            pauta.at[row.Index, 'respostas'] = tentativas[-1]
-            pauta.at[row.Index, 'nota'] = 0
-            continue
+    parser.add_argument(
+        "--reuse",
+        help="Aproveita as notas de um pauta_com_notas.csv anterior "
+             "(e.g. de uma rodada com --partial): só são corrigidos os "
+             "alunos que estão sem status nele, ou que estão no "
+             "--override. Os gabaritos e as respostas devem ser os "
+             "mesmos da rodada anterior.",
+        type=pathlib.Path,
+        metavar='PAUTA_COM_NOTAS_CSV',
+    )
 
-        # pelo menos 2 tentativas, pelo menos 1 das quais é não-vazia
-
-        positive_attempt_mask = [r.positive_attempt()
-                                 for r in tentativas]
-
-        if sum(positive_attempt_mask) == 0:
-            # Nenhum attempt positivo
-            status = 'no_positive_attempts'
-            if status in args.log:
-                print(f"* Submeteu {len(subdf)} tentativas, "
-                      f"{len(subdf) - sum(nonempty_mask)} vazia(s), e "
-                      f"nenhuma positiva: {stringid_aluno}")
-            pauta.at[row.Index, 'status'] = status
-            # salva como "resposta" a última tentativa não-vazia.
-            i = index_of_last(nonempty_mask, True)
-            pauta.at[row.Index, 'respostas'] = tentativas[i]
-            pauta.at[row.Index, 'nota'] = 0
-            continue
+    parser.add_argument(
+        "--incremental",
+        help="Guarda em STATE_JSON uma impressão digital (hash) das "
+             "tentativas de cada aluno. Rodando de novo com o mesmo "
+             "STATE_JSON (e.g. depois de baixar outra vez o "
+             "RESPOSTAS_CSV), só são corrigidos os alunos cujas "
+             "tentativas ou linha da pauta mudaram; as notas dos outros "
+             "vêm do pauta_com_notas.csv da execução anterior. Se o "
+             "--override mudar, só os alunos afetados são corrigidos; "
+             "se os gabaritos ou os adendos mudarem, ou se o "
+             "pauta_com_notas.csv tiver sido alterado, todos são. "
+             "Quando são poucos alunos a corrigir, o .gab é lido por "
+             "um índice, salvo ao lado do STATE_JSON (no arquivo "
+             "STATE_JSON.gab.idx).",
+        type=pathlib.Path,
+        metavar='STATE_JSON',
+    )
 
-        # pelo menos 2 tentativas, pelo menos 1 das quais é positiva
+    parser.add_argument(
+        "--log", "++log", choices=log_options,
+        default=DEFAULT_LOG,
+        action=UpdateSetAction,
+        help="Quais casos avisar no stdout (ao invés de processar "
+             "em silêncio)",
+    )
 
-        # Agora, decide qual a tentativa que será considerada, e
-        # depois dá a nota
+    parser.add_argument(
+        "--stats",
+        help="Salva num JSON o tempo de cada etapa, alguns contadores "
+             "e o pico de memória (ver instrument.py).",
+        type=pathlib.Path,
+        metavar='JSON',
+    )
 
-        idx_last_positive = index_of_last(positive_attempt_mask, True)
-        last_positive_attempt = tentativas[idx_last_positive]
-        num_questões = len(last_positive_attempt)
-        last_positive_count = last_positive_attempt.count()
+    parser.add_argument(
+        "--trace-memory",
+        help="Com --stats, mede também o pico de memória alocada pelo "
+             "Python (com o tracemalloc, que deixa tudo mais lento).",
+        action='store_true',
+    )
 
-        # Primeiro: decide qual tentativa será considerada...
+    args = parser.parse_args()
 
-        effective_attempt_idx = None
+    if args.incremental is not None and args.reuse is not None:
+        parser.error("Use --incremental ou --reuse, não os dois.")
 
-        if sum(positive_attempt_mask) == 1:
-            # Exatamente uma tentativa positiva
-            status = 'one_positive_attempt'
-            if status in args.log:
-                print(f"* Submeteu {len(subdf)} tentativas, exatamente "
-                      f"uma delas positiva: {stringid_aluno}")
-            pauta.at[row.Index, 'status'] = status
-            # salva como "resposta" a única tentativa positiva.
-            effective_attempt_idx = positive_attempt_mask.index(True)
+    if args.stats is not None:
+        instrument.enable(args.stats, trace_memory=args.trace_memory)
 
-        # se o último (entre os positivos) tem no máx. 2 entradas
-        # não-positivas, retorna ele
-        elif last_positive_count >= num_questões - 2:
-            status = 'lastpos_atmost2_nonpos'
-            if status in args.log:
-                print(f"* Submeteu {len(subdf)} tentativas, a última "
-                      f"positiva com {last_positive_count:>2} itens: "
-                      f"{stringid_aluno}")
-            pauta.at[row.Index, 'status'] = status
-            effective_attempt_idx = idx_last_positive
-
-        # ...e só agora dá a nota
-
-        if effective_attempt_idx is not None:
-            effective_attempt = tentativas[effective_attempt_idx]
-            pauta.at[row.Index, 'respostas'] = effective_attempt
-            nota, gabarito = effective_attempt.grade(test, g.keys)
-            pauta.at[row.Index, 'nota'] = nota
-            pauta.at[row.Index, 'gabarito'] = gabarito
-            continue
+    init()  # Inicializa as cores
 
-        subdf = subdf.copy()
-        subdf.drop(
-            ['Sobrenome', 'Nome', 'Endereço de email', 'Avaliar/10,00'],
-            axis=1, inplace=True)
-        raise NotImplementedError(
-            f"Você está encontrando este erro porque o seguinte "
-            f"aluno:\n\n    {stringid_aluno}\n\n"
-            f"submeteu um padrão de tentativas que não cai em nenhum "
-            f"dos casos testados por este script. Estas foram as "
-            f"{len(subdf)} tentativas:\n\n{subdf}\n\n"
-            f"1) Dê uma olhada no código para ver quais casos são "
-            f"contemplados;\n"
-            f"2) Descubra (talvez perguntando para o aluno) o que "
-            f"exatamente aconteceu, e qual das tentativas que ele "
-            f"submeteu deve ser levada em consideração;\n"
-            f"3) Adapte o código para levar em consideração o caso do "
-            f"aluno, e Tente Outra Vez."
-        )
+    ###
+    ### Ler as respostas dos alunos, e decidir qual das "tentativas"
+    ### será levada em consideração.
+    ###
 
-    print(f"Stats: (total {len(pauta)})")
-    total_count = 0
-    for opt in log_options:
-        count = 0
-        for comp in pauta.status == opt:
-            if comp is not pd.StringDtype().na_value and comp:
-                count += 1
-        print(f"  > {opt}: {count}")
-        total_count += count
-    na_count = 0
-    for stat in pauta.status:
-        if stat is pd.StringDtype().na_value:
-            na_count += 1
-    assert na_count == 0
-    assert total_count == len(pauta)
-
-    pauta.to_csv('pauta_com_notas.csv')
+    instrument.begin('ler_csvs')
+    respostas = Tabela.read_csv(args.RESPOSTAS_CSV)
+
+    pauta = Tabela.read_csv(args.PAUTA_CSV, index_col='numeracao')
+    instrument.count('alunos', len(pauta))
+    instrument.end()
+
+    overrides = None
+    if args.override is not None:
+        overrides = read_overrides(args.override)
+
+    results_path = pathlib.Path('pauta_com_notas.csv')
+    todo = np.arange(len(pauta))
+    lazy = False
+    if args.incremental is not None:
+        # Alunos que não mudaram desde a última execução
+        instrument.begin('impressoes_digitais')
+        inputs_key = inputs_fingerprint([*args.GABARITO, *args.adendos],
+                                        respostas)
+        fingerprints = attempt_fingerprints(pauta, respostas, overrides)
+        unchanged = unchanged_students(args.incremental, inputs_key,
+                                       pauta, fingerprints, results_path)
+        prev = {}
+        if unchanged.any():
+            prev = reusable_results(pauta, results_path, ~unchanged)
+        todo = np.array([i for i in range(len(pauta)) if i not in prev],
+                        dtype=np.int64)
+        instrument.end()
+        print(f"Modo incremental: {len(prev)} aluno(s) sem mudanças, "
+              f"{len(todo)} a corrigir")
+        if len(todo) == 0:
+            # Nada a corrigir: os arquivos salvos continuam valendo, e
+            # não é preciso ler o gabarito. Só mostra as estatísticas.
+            for col in RESULT_COLUMNS:
+                pauta[col] = [prev[i][col] for i in range(len(pauta))]
+            print_stats(pauta, overrides)
+            sys.exit(0)
+
+        # Só os alunos a corrigir, e as tentativas deles. Se forem
+        # poucos, lê do gabarito só os testes deles.
+        lazy = len(todo) <= len(pauta) // 10
+        full_pauta = pauta
+        pauta = full_pauta.take(todo)
+        emails = set(pauta['email'])
+        respostas = respostas.take(
+            k for k, email in enumerate(respostas['Endereço de email'])
+            if email in emails)
+        if overrides:
+            overrides = {email: k for email, k in overrides.items()
+                         if email in emails}
+
+    # Lê o(s) gabarito(s) e os adendos
+    index_path = None
+    if args.incremental is not None:
+        index_path = args.incremental.with_name(
+            args.incremental.name + '.gab.idx')
+    g = read_gabs(args.GABARITO, args.adendos, jobs=args.jobs,
+                  lazy=lazy, index_path=index_path)
+
+    grade_pauta(pauta, respostas, g, log=args.log, jobs=args.jobs,
+                overrides=overrides, reuse=args.reuse,
+                partial=args.partial, review_file=args.review_file,
+                incremental=args.incremental)
+
+    if args.incremental is not None:
+        # Junta os corrigidos agora com os da execução anterior
+        for col in RESULT_COLUMNS:
+            values = [None] * len(full_pauta)
+            for i, resultado in prev.items():
+                values[i] = resultado[col]
+            for i, val in zip(todo, pauta[col]):
+                values[i] = val
+            full_pauta[col] = values
+        pauta = full_pauta
+        # Os aproveitados também entram nas estatísticas
+        print_stats(pauta, overrides)
+
+    with instrument.stage('salvar'):
+        pauta.to_csv(results_path)
+        report.salvar_npz(pauta, 'pauta_com_notas.npz', g.num_items)
+        if args.incremental is not None:
+            write_incremental_state(args.incremental, inputs_key, pauta,
+                                    fingerprints, results_path)
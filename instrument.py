@@ -0,0 +1,119 @@
+"""Instrumentação opcional dos scripts: tempo de cada etapa, contadores
+(páginas procuradas, tentativas lidas, testes validados, ...) e pico de
+memória.
+
+Fica tudo desligado (e quase sem custo) até alguém chamar `enable', o
+que os scripts fazem com a opção --stats. Uso:
+
+>>> import instrument
+>>> instrument.enable('stats.json')
+>>> with instrument.stage('ler_pauta'):
+...     pauta = ...
+>>> instrument.count('alunos', len(pauta))
+>>> instrument.begin('escrever_pauta')
+>>> ...
+>>> instrument.end()
+
+Ao final do processo, o JSON é salvo no caminho passado para `enable'
+(ver `snapshot' para o conteúdo).
+"""
+
+import sys
+import json
+import time
+import atexit
+import pathlib
+import tracemalloc
+import contextlib
+from typing import Dict, Optional
+
+enabled = False
+
+# Tempo (em segundos) acumulado em cada etapa, na ordem em que as
+# etapas começaram. Etapas aninhadas têm os nomes separados por '/'.
+_stages: Dict[str, float] = {}
+_stack = []
+_counters: Dict[str, int] = {}
+_t0 = None
+
+
+def enable(path=None, trace_memory: bool = False) -> None:
+    """Liga a instrumentação. Se `path' não for None, o `snapshot' é
+    salvo nele (em JSON) quando o processo terminar. Se
+    `trace_memory', mede também o pico de memória alocada pelo Python
+    (com o tracemalloc, que deixa tudo mais lento)."""
+    global enabled, _t0
+    enabled = True
+    _t0 = time.perf_counter()
+    if trace_memory:
+        tracemalloc.start()
+    if path is not None:
+        atexit.register(dump, path)
+
+
+def begin(nome: str) -> None:
+    """Começa a etapa `nome' (dentro da etapa atual, se houver), que
+    vai até o `end' correspondente."""
+    if enabled:
+        _stack.append((nome, time.perf_counter()))
+        _stages.setdefault('/'.join(n for n, _ in _stack), 0.0)
+
+
+def end() -> None:
+    """Termina a última etapa começada com `begin', acumulando o tempo
+    dela (a mesma etapa pode acontecer mais de uma vez)."""
+    if enabled:
+        key = '/'.join(n for n, _ in _stack)
+        _, t0 = _stack.pop()
+        _stages[key] += time.perf_counter() - t0
+
+
+@contextlib.contextmanager
+def stage(nome: str):
+    """Como `begin' e `end', em volta do bloco `with'."""
+    begin(nome)
+    try:
+        yield
+    finally:
+        end()
+
+
+def count(nome: str, n: int = 1) -> None:
+    if enabled:
+        _counters[nome] = _counters.get(nome, 0) + n
+
+
+def peak_rss_mib() -> Optional[float]:
+    """Pico de memória (RSS) do processo, em MiB, ou None se não der
+    para medir (e.g. no Windows)."""
+    try:
+        import resource
+    except ModuleNotFoundError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak /= 1024  # bytes no macOS, KiB no Linux
+    return peak / 1024
+
+
+def snapshot() -> dict:
+    """Tudo o que foi medido até agora."""
+    result = {
+        'script': pathlib.Path(sys.argv[0]).name,
+        'argv': sys.argv[1:],
+        'total_s': (time.perf_counter() - _t0
+                    if _t0 is not None else None),
+        'stages_s': dict(_stages),
+        'counters': dict(_counters),
+        'peak_rss_mib': peak_rss_mib(),
+    }
+    if tracemalloc.is_tracing():
+        result['tracemalloc_peak_mib'] = \
+            tracemalloc.get_traced_memory()[1] / 2**20
+    return result
+
+
+def dump(path) -> None:
+    with pathlib.Path(path).open('w') as file:
+        json.dump(snapshot(), file, indent=2, ensure_ascii=False)
+        file.write('\n')
@@ -1,12 +1,18 @@
 #!/usr/bin/env python3
 # ./moodle_to_atena.py --help
 
+import os
+import csv
 import sys
 import pathlib
 import argparse
 import collections
+from typing import List
 
 import pandas as pd
+import xlwt
+
+import instrument
 
 # WARNING: OS RESULTADOS GERADOS ESTARÃO ERRADOS SE VOCÊ USAR
 # PYTHON 3.5 OU ANTERIOR. Se a versão for 3.6, talvez funcione.
@@ -52,60 +58,64 @@ def warn(txt):
     print(f"{Fore.RED}WARNING:{Style.RESET_ALL} {txt}", file=sys.stderr)
 
 
-if __name__ == "__main__":
-
-    parser = argparse.ArgumentParser(
-        description="Gera pauta do AtenaME a partir dos CSVs do "
-                    "Moodle.")
-
-    parser.add_argument(
-        "--no-colors",
-        help="Se não encontrar o pacote 'colorama', não tenta usar "
-             "cores.",
-        action='store_false',
-        dest='use_colors',
-    )
-
-    parser.add_argument(
-        "--start-extra-dre-at",
-        # TODO: fazer com que isso não ~dê ruim~
-        help="Valor inicial para DREs coringas. De 0 a 999 (mas se o "
-             "total passar de 999 vai dar ruim). O default é zero.",
-        type=int,
-        default=0,
-    )
-
-    parser.add_argument(
-        "USUARIOS_CSV",
-        help="Arquivo CSV com todos os usuários cadastrados no "
-             "Moodle, conforme descrito no README.",
-        type=pathlib.Path,
-    )
-
-    parser.add_argument(
-        "PARTICIPANTS_CSV",
-        help="Arquivo CSV com somente os usuários que vão entrar "
-             "na pauta gerada, conforme descrito no README.",
-        type=pathlib.Path,
-    )
-
-    # TODO: aceitar os nomes dos arquivos novos PautaAtena.{csv,xls}
-    #       como parâmetros opcionais (os defaults continuarão sendo
-    #       os defaults atuais)
-
-    args = parser.parse_args()
-
-    init()  # Inicializa as cores
-
-    usuarios = pd.read_csv(
-        args.USUARIOS_CSV, dtype={'idnumber': 'string'})
-
-    participants = pd.read_csv(args.PARTICIPANTS_CSV)
+# Colunas da pauta, na ordem em que são escritas.
+PAUTA_COLUMNS = ['numeracao', 'chamada', 'email', 'dre', 'nomecompleto']
+
+# Limite de linhas de uma planilha no formato .xls (BIFF8).
+XLS_MAX_ROWS = 65536
+
+# De quantas em quantas linhas o xlwt deve serializar as linhas já
+# escritas (e liberar os objetos Row correspondentes).
+XLS_FLUSH_EVERY = 1000
+
+
+def write_pauta(pauta: List[dict], csv_path, xls_path):
+    """Escreve a pauta em CSV (com cabeçalho, em UTF-8) e em XLS (sem
+    cabeçalho, que é o que o AtenaME espera), numa única passada pelas
+    linhas. As colunas são as PAUTA_COLUMNS, mesmo com a pauta vazia.
+
+    As linhas do XLS vão sendo serializadas pelo xlwt à medida que são
+    escritas, de forma que não fica uma cópia inteira da planilha em
+    objetos Python na memória.
+    """
+    if len(pauta) > XLS_MAX_ROWS:
+        raise ValueError(
+            f"A pauta tem {len(pauta)} linhas, mas o formato .xls só "
+            f"suporta até {XLS_MAX_ROWS}.")
+
+    fieldnames = PAUTA_COLUMNS
+    workbook = xlwt.Workbook()
+    sheet = workbook.add_sheet('Sheet1')
+    with open(csv_path, 'w', newline='', encoding='utf-8') as csv_file:
+        writer = csv.writer(csv_file, lineterminator=os.linesep)
+        writer.writerow(fieldnames)
+        for i, d in enumerate(pauta):
+            values = [d[k] for k in fieldnames]
+            writer.writerow(values)
+            for j, v in enumerate(values):
+                sheet.write(i, j, v)
+            if (i + 1) % XLS_FLUSH_EVERY == 0:
+                sheet.flush_row_data()
+    workbook.save(os.fspath(xls_path))
+
+
+def read_moodle_csvs(usuarios_csv, participants_csv):
+    """Lê o USUARIOS_CSV e o PARTICIPANTS_CSV (ver o README)."""
+    usuarios = pd.read_csv(usuarios_csv, dtype={'idnumber': 'string'})
+    participants = pd.read_csv(participants_csv)
     participants.rename(
         columns={"Endereço de email": "Email"}, inplace=True)
+    return usuarios, participants
+
 
+def make_pauta(usuarios: pd.DataFrame, participants: pd.DataFrame,
+               start_extra_dre_at: int = 0) -> List[dict]:
+    """Monta a pauta (uma lista de dicts, ordenada pelo nome) com os
+    participantes, usando os dados de cada um que estão nos usuários.
+    Os alunos sem DRE ganham DREs coringas a partir de
+    `start_extra_dre_at'."""
     pauta = []  # lista de dicts
-    count_missing_dre = args.start_extra_dre_at
+    count_missing_dre = start_extra_dre_at
     for row in participants.itertuples():
 
         # Verifica que este email já não está na pauta
@@ -206,13 +216,88 @@ if __name__ == "__main__":
     pauta = sorted(pauta, key=lambda d: d['nomecompleto'])
     for i in range(len(pauta)):
         pauta[i]['numeracao'] = i + 1
-    pauta_final_df = pd.DataFrame(pauta)
+    return pauta
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Gera pauta do AtenaME a partir dos CSVs do "
+                    "Moodle.")
+
+    parser.add_argument(
+        "--no-colors",
+        help="Se não encontrar o pacote 'colorama', não tenta usar "
+             "cores.",
+        action='store_false',
+        dest='use_colors',
+    )
+
+    parser.add_argument(
+        "--start-extra-dre-at",
+        # TODO: fazer com que isso não ~dê ruim~
+        help="Valor inicial para DREs coringas. De 0 a 999 (mas se o "
+             "total passar de 999 vai dar ruim). O default é zero.",
+        type=int,
+        default=0,
+    )
+
+    parser.add_argument(
+        "USUARIOS_CSV",
+        help="Arquivo CSV com todos os usuários cadastrados no "
+             "Moodle, conforme descrito no README.",
+        type=pathlib.Path,
+    )
+
+    parser.add_argument(
+        "PARTICIPANTS_CSV",
+        help="Arquivo CSV com somente os usuários que vão entrar "
+             "na pauta gerada, conforme descrito no README.",
+        type=pathlib.Path,
+    )
+
+    # TODO: aceitar os nomes dos arquivos novos PautaAtena.{csv,xls}
+    #       como parâmetros opcionais (os defaults continuarão sendo
+    #       os defaults atuais)
+
+    parser.add_argument(
+        "--stats",
+        help="Salva num JSON o tempo de cada etapa, alguns contadores "
+             "e o pico de memória (ver instrument.py).",
+        type=pathlib.Path,
+        metavar='JSON',
+    )
+
+    parser.add_argument(
+        "--trace-memory",
+        help="Com --stats, mede também o pico de memória alocada pelo "
+             "Python (com o tracemalloc, que deixa tudo mais lento).",
+        action='store_true',
+    )
+
+    args = parser.parse_args()
+
+    if args.stats is not None:
+        instrument.enable(args.stats, trace_memory=args.trace_memory)
+
+    init()  # Inicializa as cores
+
+    instrument.begin('ler_csvs')
+    usuarios, participants = read_moodle_csvs(args.USUARIOS_CSV,
+                                              args.PARTICIPANTS_CSV)
+    instrument.count('usuarios', len(usuarios))
+    instrument.count('participantes', len(participants))
+    instrument.end()
+
+    instrument.begin('montar_pauta')
+    pauta = make_pauta(usuarios, participants,
+                       args.start_extra_dre_at)
+    instrument.count('alunos', len(pauta))
+    instrument.end()
 
     # TODO: verificar se os arquivos já existem e, caso existam,
     #       perguntar se o usuário quer mesmo overwrite.
     # TODO: criar uma opção '-y'/'--overwrite' que responde "sim"
     #       automaticamente para a pergunta acima.
-    pauta_final_df.to_csv(
-        'PautaAtena.csv', index=False)
-    pauta_final_df.to_excel(
-        'PautaAtena.xls', index=False, header=False)
+    with instrument.stage('escrever_pauta'):
+        write_pauta(pauta, 'PautaAtena.csv', 'PautaAtena.xls')
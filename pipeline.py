@@ -0,0 +1,530 @@
+#!/usr/bin/env python3
+# ./pipeline.py --help
+
+import os
+import sys
+import json
+import shutil
+import hashlib
+import pathlib
+import argparse
+import importlib
+import collections
+
+import instrument
+from tabela import Tabela
+
+assert sys.version_info >= (3, 8)
+
+
+# TODO: tornar o 'colorama' obrigatório.
+try:
+    from colorama import init, Fore, Style
+except ModuleNotFoundError:
+    def init():
+        global Fore, Style
+        global args
+        fore_dict = {
+            'RED': "\033[91m",
+        }
+        style_dict = {
+            'RESET_ALL': "\033[0m",
+        }
+        if not args.use_colors:
+            for d in fore_dict, style_dict:
+                for k in d:
+                    d[k] = ""
+        else:
+            print("WARNING: faça 'pip install colorama' para que as "
+                  "cores funcionem de forma cross-platform.",
+                  file=sys.stderr)
+        TermColors_Fore = collections.namedtuple(
+            "TermColors_Fore", fore_dict.keys())
+        Fore = TermColors_Fore(*fore_dict.values())
+        TermColors_Style = collections.namedtuple(
+            "TermColors_Style", style_dict.keys())
+        Style = TermColors_Style(*style_dict.values())
+
+
+def warn(txt):
+    print(f"{Fore.RED}WARNING:{Style.RESET_ALL} {txt}",
+          file=sys.stderr)
+
+
+def error(txt):
+    print(f"{Fore.RED}ERROR:{Style.RESET_ALL} {txt}",
+          file=sys.stderr)
+
+
+# Arquivos com nomes fixos, escritos pelos scripts (ver o README)
+PAUTA_CSV = pathlib.Path('PautaAtena.csv')
+PAUTA_XLS = pathlib.Path('PautaAtena.xls')
+PAUTA_COM_NOTAS_CSV = pathlib.Path('pauta_com_notas.csv')
+PAUTA_COM_NOTAS_NPZ = pathlib.Path('pauta_com_notas.npz')
+ESTATISTICAS_CSV = pathlib.Path('estatisticas_por_questao.csv')
+ANALISE_CSV = pathlib.Path('analise_de_itens.csv')
+PARECIDAS_CSV = pathlib.Path('respostas_parecidas.csv')
+
+# Diretório dos scripts. O código de cada etapa também conta como
+# entrada dela: se o script mudar, a etapa roda de novo.
+SCRIPTS_DIR = pathlib.Path(__file__).resolve().parent
+
+
+def script_files(*nomes):
+    return [SCRIPTS_DIR / f"{nome}.py" for nome in nomes]
+
+
+def use_script(nome):
+    """Importa um dos scripts, com as mesmas cores (Fore e Style) do
+    pipeline. As cores já foram inicializadas pelo init() daqui, uma
+    vez só: o init() de cada script repetiria o aviso de que falta o
+    colorama (ou, com o colorama, embrulharia o stdout de novo)."""
+    mod = importlib.import_module(nome)
+    mod.args = args
+    mod.Fore, mod.Style = Fore, Style
+    return mod
+
+
+class State:
+    """O que é guardado entre uma execução e outra, num JSON: o sha256
+    de cada arquivo lido (que só é recalculado se o tamanho ou a data
+    de modificação mudarem), e, para cada etapa que terminou, a chave
+    das entradas dela e as saídas que ela gerou."""
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        try:
+            data = json.loads(self.path.read_text())
+        except FileNotFoundError:
+            data = {}
+        self.arquivos = data.get('arquivos', {})
+        self.etapas = data.get('etapas', {})
+
+    def save(self):
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        with tmp.open('w') as file:
+            json.dump({'arquivos': self.arquivos, 'etapas': self.etapas},
+                      file, indent=2, ensure_ascii=False)
+            file.write('\n')
+        os.replace(tmp, self.path)
+
+    def file_hash(self, path) -> str:
+        path = pathlib.Path(path)
+        st = path.stat()
+        key = os.fspath(path.resolve())
+        entry = self.arquivos.get(key)
+        if (entry is not None and entry['tamanho'] == st.st_size
+                and entry['mtime_ns'] == st.st_mtime_ns):
+            return entry['sha256']
+        h = hashlib.sha256()
+        with path.open('rb') as file:
+            for bloco in iter(lambda: file.read(1 << 20), b''):
+                h.update(bloco)
+        self.arquivos[key] = {
+            'tamanho': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'sha256': h.hexdigest(),
+        }
+        return h.hexdigest()
+
+    def stage_key(self, nome: str, entradas, opcoes: dict) -> str:
+        """Chave que muda quando o conteúdo de alguma das entradas (ou
+        alguma das opções) da etapa muda."""
+        data = {
+            'etapa': nome,
+            'opcoes': opcoes,
+            'entradas': [[os.fspath(p), self.file_hash(p)]
+                         for p in entradas],
+        }
+        return hashlib.sha256(
+            json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+    def up_to_date(self, nome: str, chave: str, saidas) -> bool:
+        etapa = self.etapas.get(nome, {})
+        return (etapa.get('chave') == chave
+                and all(pathlib.Path(p).exists() for p in saidas))
+
+    def done(self, nome: str, chave: str, saidas):
+        self.etapas[nome] = {
+            'chave': chave,
+            'saidas': [os.fspath(p) for p in saidas],
+        }
+        self.save()
+
+
+def run_stage(state: State, nome: str, fct, entradas, saidas,
+              opcoes: dict, force: bool = False) -> bool:
+    """Roda a etapa `nome' (chamando `fct()'), a não ser que as
+    entradas e as opções sejam as mesmas da última vez em que ela
+    terminou, e as saídas ainda existam. Os diretórios gerados pela
+    execução anterior da etapa são apagados antes de ela rodar de
+    novo. Retorna se a etapa rodou."""
+    faltando = [p for p in entradas if not pathlib.Path(p).exists()]
+    if faltando:
+        error(f"Etapa '{nome}': arquivo(s) de entrada não "
+              f"encontrado(s): {', '.join(map(os.fspath, faltando))}")
+        sys.exit(1)
+    chave = state.stage_key(nome, entradas, opcoes)
+    if not force and state.up_to_date(nome, chave, saidas):
+        print(f"> Etapa '{nome}': nada mudou desde a última execução, "
+              f"pulando.")
+        return False
+
+    print(f"> Etapa '{nome}'")
+    for p in state.etapas.get(nome, {}).get('saidas', []):
+        if pathlib.Path(p).is_dir():
+            shutil.rmtree(p)
+    with instrument.stage(nome):
+        fct()
+    state.done(nome, chave, saidas)
+    return True
+
+
+###
+### Etapas. O que uma etapa produz e a seguinte usa fica em `mem' (a
+### pauta, o gabarito, a pauta com notas), sem precisar ser lido de
+### novo dos arquivos. Se a etapa anterior foi pulada, a seguinte lê
+### os arquivos.
+###
+
+def pauta_tabela(mem) -> Tabela:
+    """A pauta, como uma Tabela igual à lida do PAUTA_CSV."""
+    if 'pauta' not in mem:
+        return Tabela.read_csv(PAUTA_CSV, index_col='numeracao')
+    pauta = mem['pauta']
+    cols = [c for c in (pauta[0] if pauta else {}) if c != 'numeracao']
+    return Tabela({c: [d[c] for d in pauta] for c in cols},
+                  [d['numeracao'] for d in pauta], 'numeracao')
+
+
+def read_gab(args, mem):
+    if 'gab' not in mem:
+        grade = use_script('grade')
+        mem['gab'] = grade.read_gabs(args.gabarito, args.adendos,
+                                     jobs=args.jobs)
+    return mem['gab']
+
+
+def stage_pauta(args, state, mem):
+    entradas = [args.usuarios, args.participants,
+                *script_files('moodle_to_atena')]
+    saidas = [PAUTA_CSV, PAUTA_XLS]
+
+    def fct():
+        moodle_to_atena = use_script('moodle_to_atena')
+        usuarios, participants = moodle_to_atena.read_moodle_csvs(
+            args.usuarios, args.participants)
+        mem['pauta'] = moodle_to_atena.make_pauta(
+            usuarios, participants, args.start_extra_dre_at)
+        moodle_to_atena.write_pauta(mem['pauta'], PAUTA_CSV, PAUTA_XLS)
+
+    run_stage(state, 'pauta', fct, entradas, saidas,
+              {'start_extra_dre_at': args.start_extra_dre_at},
+              force=args.force)
+
+
+def stage_split(args, state, mem):
+    entradas = [args.lote, PAUTA_CSV, args.known_values,
+                *script_files('split_pdfs')]
+    provas_dir = (pathlib.Path() / args.provas).resolve()
+    saidas = [provas_dir, provas_dir.with_name(provas_dir.name + '.zip')]
+    opcoes = {
+        'skip_pages': args.skip_pages,
+        'by_dre': args.by_dre,
+        'lazy': args.lazy,
+        'compact': args.compact,
+    }
+
+    def fct():
+        split_pdfs = use_script('split_pdfs')
+        if 'pauta' in mem:
+            pauta_atena = pauta_tabela(mem).to_dataframe()
+            pauta_atena['dre'] = pauta_atena['dre'].astype('string')
+            split_pdfs.check_pauta(pauta_atena)
+        else:
+            pauta_atena = split_pdfs.read_pauta(PAUTA_CSV)
+        known_values = split_pdfs.read_known_values(args.known_values)
+        split_pdfs.split_lote(args.lote, args.skip_pages, pauta_atena,
+                              known_values, provas_dir,
+                              by_dre=args.by_dre, lazy=args.lazy,
+                              compact=args.compact)
+
+    run_stage(state, 'split', fct, entradas, saidas, opcoes,
+              force=args.force)
+
+
+def stage_grade(args, state, mem):
+    entradas = [PAUTA_CSV, args.respostas, *args.gabarito,
+                *args.adendos,
+                *script_files('grade', 'gab', 'tabela', 'report')]
+    if args.override is not None:
+        entradas.append(args.override)
+    saidas = [PAUTA_COM_NOTAS_CSV, PAUTA_COM_NOTAS_NPZ]
+
+    def fct():
+        grade = use_script('grade')
+        import report
+        pauta = pauta_tabela(mem)
+        respostas = Tabela.read_csv(args.respostas)
+        overrides = (grade.read_overrides(args.override)
+                     if args.override is not None else None)
+        g = read_gab(args, mem)
+        grade.grade_pauta(pauta, respostas, g,
+                          log=grade.DEFAULT_LOG, jobs=args.jobs,
+                          overrides=overrides, partial=args.partial)
+        pauta.to_csv(PAUTA_COM_NOTAS_CSV)
+        report.salvar_npz(pauta, PAUTA_COM_NOTAS_NPZ, g.num_items)
+        mem['pauta_com_notas'] = pauta
+
+    run_stage(state, 'grade', fct, entradas, saidas,
+              {'partial': args.partial}, force=args.force)
+
+
+def stage_report(args, state, mem):
+    entradas = [PAUTA_COM_NOTAS_CSV, *args.gabarito, *args.adendos,
+                *script_files('report', 'gab', 'tabela')]
+    saidas = [ESTATISTICAS_CSV, ANALISE_CSV, PARECIDAS_CSV]
+
+    def fct():
+        import report
+        if 'pauta_com_notas' in mem:
+            df = mem['pauta_com_notas'].to_dataframe()
+        else:
+            df = report.pauta_com_notas(PAUTA_COM_NOTAS_CSV)
+        report.estatisticas_por_questao(df).to_csv(ESTATISTICAS_CSV)
+        g = read_gab(args, mem)
+        report.analise_de_itens(df, g).to_csv(ANALISE_CSV)
+        report.respostas_parecidas(df, g, top=args.top).to_csv(
+            PARECIDAS_CSV)
+        print(f"  . {ESTATISTICAS_CSV}, {ANALISE_CSV} e {PARECIDAS_CSV} "
+              f"salvos")
+
+    run_stage(state, 'report', fct, entradas, saidas,
+              {'top': args.top}, force=args.force)
+
+
+STAGES = {
+    'pauta': stage_pauta,
+    'split': stage_split,
+    'grade': stage_grade,
+    'report': stage_report,
+}
+
+
+###
+### Opções de cada etapa
+###
+
+def add_pauta_args(parser):
+    group = parser.add_argument_group("etapa 'pauta' (moodle_to_atena.py)")
+    group.add_argument(
+        "--usuarios",
+        help="USUARIOS_CSV do moodle_to_atena.py (default: "
+             "Usuarios.csv).",
+        type=pathlib.Path,
+        default=pathlib.Path('Usuarios.csv'),
+    )
+    group.add_argument(
+        "--participants",
+        help="PARTICIPANTS_CSV do moodle_to_atena.py (default: "
+             "participants.csv).",
+        type=pathlib.Path,
+        default=pathlib.Path('participants.csv'),
+    )
+    group.add_argument(
+        "--start-extra-dre-at",
+        help="Como no moodle_to_atena.py.",
+        type=int,
+        default=0,
+    )
+
+
+def add_split_args(parser):
+    group = parser.add_argument_group("etapa 'split' (split_pdfs.py)")
+    group.add_argument(
+        "--lote",
+        help="LOTE_PDF do split_pdfs.py (default: Lote.pdf).",
+        type=pathlib.Path,
+        default=pathlib.Path('Lote.pdf'),
+    )
+    group.add_argument(
+        "--skip-pages",
+        help="SKIP_PAGES do split_pdfs.py.",
+        type=int,
+        required=True,
+    )
+    group.add_argument(
+        "--known-values",
+        help="KNOWN_VALUES_CSV do split_pdfs.py (default: "
+             "known_values.csv).",
+        type=pathlib.Path,
+        default=pathlib.Path('known_values.csv'),
+    )
+    group.add_argument(
+        "--provas",
+        help="PROVAS_DIR do split_pdfs.py (default: Provas). Se a "
+             "etapa rodar de novo, o diretório gerado da vez anterior "
+             "é apagado.",
+        type=pathlib.Path,
+        default=pathlib.Path('Provas'),
+    )
+    for opt in 'by-dre', 'lazy', 'compact':
+        group.add_argument(
+            f"--{opt}",
+            help="Como no split_pdfs.py.",
+            action='store_true',
+        )
+
+
+def add_gab_args(parser):
+    group = parser.add_argument_group("gabarito (grade.py)")
+    group.add_argument(
+        "--gabarito",
+        help="GABARITO do grade.py (default: Lote.gab).",
+        type=pathlib.Path,
+        nargs='+',
+        default=[pathlib.Path('Lote.gab')],
+    )
+    group.add_argument(
+        "--addendum",
+        help="Como no grade.py.",
+        type=pathlib.Path,
+        action='append',
+        metavar='ADG',
+        dest='adendos',
+        default=[],
+    )
+    group.add_argument(
+        "--jobs", "-j",
+        help="Como no grade.py.",
+        type=int,
+        default=1,
+    )
+
+
+def add_grade_args(parser):
+    group = parser.add_argument_group("etapa 'grade' (grade.py)")
+    group.add_argument(
+        "--respostas",
+        help="RESPOSTAS_CSV do grade.py (default: Respostas.csv).",
+        type=pathlib.Path,
+        default=pathlib.Path('Respostas.csv'),
+    )
+    group.add_argument(
+        "--override",
+        help="Como no grade.py.",
+        type=pathlib.Path,
+        metavar='OVERRIDE_CSV',
+    )
+    group.add_argument(
+        "--partial",
+        help="Como no grade.py.",
+        action='store_true',
+    )
+
+
+def add_report_args(parser):
+    group = parser.add_argument_group("etapa 'report' (report.py)")
+    group.add_argument(
+        "--top",
+        help=f"Quantidade de pares de alunos no {PARECIDAS_CSV} (os com "
+             f"mais respostas erradas iguais). O default é 100.",
+        type=int,
+        default=100,
+    )
+
+
+if __name__ == "__main__":
+
+    common = argparse.ArgumentParser(add_help=False)
+
+    common.add_argument(
+        "--no-colors",
+        help="Se não encontrar o pacote 'colorama', não tenta "
+             "usar cores.",
+        action='store_false',
+        dest='use_colors',
+    )
+
+    common.add_argument(
+        "--state",
+        help="Onde guardar os hashes das entradas de cada etapa "
+             "(default: pipeline_state.json).",
+        type=pathlib.Path,
+        default=pathlib.Path('pipeline_state.json'),
+    )
+
+    common.add_argument(
+        "--force",
+        help="Roda as etapas mesmo que as entradas não tenham mudado.",
+        action='store_true',
+    )
+
+    common.add_argument(
+        "--stats",
+        help="Salva num JSON o tempo de cada etapa, alguns contadores "
+             "e o pico de memória (ver instrument.py).",
+        type=pathlib.Path,
+        metavar='JSON',
+    )
+
+    common.add_argument(
+        "--trace-memory",
+        help="Com --stats, mede também o pico de memória alocada pelo "
+             "Python (com o tracemalloc, que deixa tudo mais lento).",
+        action='store_true',
+    )
+
+    parser = argparse.ArgumentParser(
+        description="Roda as etapas (moodle_to_atena.py, split_pdfs.py, "
+                    "grade.py e as tabelas do report.py) num processo "
+                    "só, passando a pauta, o gabarito e as notas de uma "
+                    "etapa para a outra sem ler os arquivos de novo. "
+                    "Uma etapa só roda se o conteúdo de alguma entrada "
+                    "dela mudou desde a última vez.")
+    subparsers = parser.add_subparsers(dest='etapa', required=True,
+                                       metavar='ETAPA')
+
+    options = {
+        'pauta': [add_pauta_args],
+        'split': [add_split_args],
+        'grade': [add_gab_args, add_grade_args],
+        'report': [add_gab_args, add_report_args],
+    }
+    helps = {
+        'pauta': "Gera o PautaAtena.csv e o PautaAtena.xls.",
+        'split': "Separa o lote em uma prova por aluno.",
+        'grade': "Dá as notas (pauta_com_notas.csv e .npz).",
+        'report': f"Salva o {ESTATISTICAS_CSV}, o {ANALISE_CSV} e o "
+                  f"{PARECIDAS_CSV}.",
+        'all': "Todas as etapas acima, em ordem.",
+    }
+    for etapa, h in helps.items():
+        sub = subparsers.add_parser(etapa, help=h, description=h,
+                                    parents=[common])
+        if etapa == 'all':
+            add_pauta_args(sub)
+            add_split_args(sub)
+            add_gab_args(sub)
+            add_grade_args(sub)
+            add_report_args(sub)
+        else:
+            for add_args in options[etapa]:
+                add_args(sub)
+
+    args = parser.parse_args()
+
+    if args.stats is not None:
+        instrument.enable(args.stats, trace_memory=args.trace_memory)
+
+    init()  # Inicializa as cores
+
+    state = State(args.state)
+    mem = {}
+    etapas = list(STAGES) if args.etapa == 'all' else [args.etapa]
+    for etapa in etapas:
+        STAGES[etapa](args, state, mem)
+
+    peak = instrument.peak_rss_mib()
+    if peak is not None:
+        print(f"> Pico de memória: {peak:.1f} MiB")
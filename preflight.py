@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# ./preflight.py --help
+
+import os
+import sys
+import pathlib
+import argparse
+import collections
+
+import pandas as pd
+
+from gab import Gab, GabIndex
+
+# Opcional: se tiver o pypdf, conta as páginas do lote sem carregá-lo
+# inteiro na memória.
+try:
+    import pypdf
+except ModuleNotFoundError:
+    pypdf = None
+
+assert sys.version_info >= (3, 8)
+
+
+# TODO: tornar o 'colorama' obrigatório.
+try:
+    from colorama import init, Fore, Style
+except ModuleNotFoundError:
+    def init():
+        global Fore, Style
+        global args
+        fore_dict = {
+            'RED': "\033[91m",
+        }
+        style_dict = {
+            'RESET_ALL': "\033[0m",
+        }
+        if not args.use_colors:
+            for d in fore_dict, style_dict:
+                for k in d:
+                    d[k] = ""
+        else:
+            print("WARNING: faça 'pip install colorama' para que as "
+                  "cores funcionem de forma cross-platform.",
+                  file=sys.stderr)
+        TermColors_Fore = collections.namedtuple(
+            "TermColors_Fore", fore_dict.keys())
+        Fore = TermColors_Fore(*fore_dict.values())
+        TermColors_Style = collections.namedtuple(
+            "TermColors_Style", style_dict.keys())
+        Style = TermColors_Style(*style_dict.values())
+
+
+def warn(txt):
+    print(f"{Fore.RED}WARNING:{Style.RESET_ALL} {txt}",
+          file=sys.stderr)
+
+
+# Quantidade de erros encontrados até agora
+num_errors = 0
+
+
+def error(txt):
+    global num_errors
+    num_errors += 1
+    print(f"{Fore.RED}ERROR:{Style.RESET_ALL} {txt}",
+          file=sys.stderr)
+
+
+def count_pdf_pages(path) -> int:
+    """Quantidade de páginas do PDF. Com o pypdf, lê só a árvore de
+    páginas; sem ele, o pdfrw carrega o arquivo inteiro."""
+    if pypdf is not None:
+        with open(path, 'rb') as file:
+            return len(pypdf.PdfReader(file).pages)
+    from pdfrw import PdfReader
+    return len(PdfReader(os.fspath(path)).pages)
+
+
+def gab_students(path):
+    """Retorna (num_tests, lista de (nome, campos) dos testes com nome)
+    do gabarito. Para um .gab, monta o índice (ver gab.GabIndex) só na
+    memória, sem salvar nada ao lado do .gab; um .zip é lido por
+    inteiro."""
+    path = pathlib.Path(path)
+    if path.suffix == '.gab':
+        g = Gab.lazy_from_gab_file(path)
+        index = GabIndex.build(path)
+        return g.num_tests, [(nome, fields) for nome, fields in
+                             zip(index.nomes, index.fields)
+                             if nome is not None]
+    g = Gab.from_file(path)
+    return g.num_tests, [(t.st.nome, t.st.fields)
+                         for t in g.testes_com_nome]
+
+
+def check_unique(pauta: pd.DataFrame, col: str):
+    num_missing = pauta[col].isna().sum()
+    if num_missing > 0:
+        error(f"{num_missing} linha(s) sem valor na coluna '{col}' da "
+              f"pauta.")
+    values = pauta[col].dropna()
+    dup = values[values.duplicated(keep=False)]
+    if len(dup) > 0:
+        error(f"Valores repetidos na coluna '{col}' da pauta: "
+              f"{', '.join(sorted(dup.astype(str).unique()))}")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Verifica, em poucos segundos, se a pauta, o(s) "
+                    "gabarito(s), o known_values e o lote de provas "
+                    "batem entre si, antes de rodar o split_pdfs.py e o "
+                    "grade.py. Os argumentos são os mesmos desses "
+                    "scripts.")
+
+    parser.add_argument(
+        "--no-colors",
+        help="Se não encontrar o pacote 'colorama', não tenta "
+             "usar cores.",
+        action='store_false',
+        dest='use_colors',
+    )
+
+    parser.add_argument(
+        "LOTE_PDF",
+        help="Arquivo de lote de provas, gerado pelo AtenaME.",
+        type=pathlib.Path,
+    )
+
+    parser.add_argument(
+        "SKIP_PAGES",
+        help="Quantidade de páginas de lista de presença no início "
+             "do LOTE_PDF, conforme o README.",
+        type=int,
+    )
+
+    parser.add_argument(
+        "PAUTA_CSV",
+        help="Arquivo de pauta gerado pelo moodle_to_atena.py.",
+        type=pathlib.Path,
+    )
+
+    parser.add_argument(
+        "KNOWN_VALUES_CSV",
+        help="Tabela de DREs verificados manualmente, conforme "
+             "descrito no README.",
+        type=pathlib.Path,
+    )
+
+    parser.add_argument(
+        "PROVAS_DIR",
+        help="Diretório (inexistente) que será passado para o "
+             "split_pdfs.py.",
+        type=pathlib.Path,
+    )
+
+    parser.add_argument(
+        "GABARITO",
+        help="Arquivo(s) '.gab' ou '.zip' do AtenaME, como no "
+             "grade.py. O LOTE_PDF deve ser o lote desses gabaritos.",
+        type=pathlib.Path,
+        nargs='+',
+    )
+
+    args = parser.parse_args()
+
+    init()  # Inicializa as cores
+
+    ### Diretório de saída do split_pdfs.py
+    print("> Verificando o PROVAS_DIR...")
+    provas_dir = (pathlib.Path() / args.PROVAS_DIR).resolve()
+    if provas_dir.exists():
+        error(f"O diretório {provas_dir} já existe.")
+
+    ### Pauta
+    print("> Verificando a pauta...")
+    pauta = pd.read_csv(args.PAUTA_CSV, index_col='numeracao',
+                        dtype={
+                            'chamada': 'string',
+                            'email': 'string',
+                            'dre': 'string',
+                            'nomecompleto': 'string',
+                        })
+    check_unique(pauta, 'dre')
+    check_unique(pauta, 'email')
+    if not pauta['nomecompleto'].is_unique:
+        warn("Nomes (completos!) repetidos na pauta (o split_pdfs.py "
+             "só vai conseguir separar essas provas com --by-dre ou "
+             "com o known_values).")
+
+    ### Gabarito(s)
+    print("> Verificando o(s) gabarito(s)...")
+    num_tests = 0
+    gab_fields = collections.defaultdict(list)  # nome -> [campos]
+    for path in args.GABARITO:
+        nt, students = gab_students(path)
+        num_tests += nt
+        for nome, fields in students:
+            gab_fields[nome].append(fields)
+        print(f"  . {path}: {nt} testes, {len(students)} com nome")
+    for row in pauta.itertuples():
+        matches = gab_fields.get(row.nomecompleto, [])
+        if len(matches) == 0:
+            error(f"Aluno da pauta não está no gabarito: "
+                  f"{row.nomecompleto} ({row.dre})")
+        elif len(matches) > 1:
+            error(f"Aluno aparece mais de uma vez no gabarito: "
+                  f"{row.nomecompleto} ({row.dre})")
+        else:
+            fields = matches[0]
+            row_fields = [
+                s.replace('_', '-').replace(',', '-').replace(':', '-')
+                for s in row[1:1 + len(fields)]
+            ]
+            if list(fields) != row_fields:
+                error(f"Pauta não bate com o gabarito (campos "
+                      f"diferentes) para {row.nomecompleto}: "
+                      f"{row_fields} != {list(fields)}")
+    extra = set(gab_fields) - set(pauta['nomecompleto'])
+    if extra:
+        warn(f"{len(extra)} teste(s) com nome no gabarito não estão na "
+             f"pauta.")
+
+    ### Lote
+    print("> Verificando o lote...")
+    num_pages = count_pdf_pages(args.LOTE_PDF)
+    num_test_pages = num_pages - args.SKIP_PAGES
+    print(f"  . {num_pages} páginas, {args.SKIP_PAGES} de lista de "
+          f"presença")
+    if (num_test_pages <= 0 or num_tests == 0
+            or num_test_pages % num_tests != 0):
+        error(f"O lote tem {num_test_pages} páginas de provas (tirando "
+              f"as {args.SKIP_PAGES} de lista de presença), o que não "
+              f"é múltiplo dos {num_tests} testes do(s) gabarito(s). "
+              f"O SKIP_PAGES está certo?")
+    else:
+        print(f"  . {num_test_pages // num_tests} página(s) por prova")
+
+    ### Known values
+    print("> Verificando o known_values...")
+    known_values = pd.read_csv(
+        args.KNOWN_VALUES_CSV,
+        index_col='pgnum',
+        dtype={'dre': 'string'})
+    if not known_values.index.is_unique:
+        error("Entradas duplicadas no arquivo de 'known values'.")
+    for row in known_values.itertuples():
+        if not args.SKIP_PAGES < row.Index <= num_pages:
+            error(f"Página {row.Index} do known_values está fora das "
+                  f"páginas de provas do lote ({args.SKIP_PAGES + 1} "
+                  f"a {num_pages}).")
+        if row.dre not in set(pauta['dre']):
+            warn(f"DRE {row.dre} (página {row.Index} do known_values) "
+                 f"não está na pauta.")
+
+    if num_errors > 0:
+        print(f"> {num_errors} erro(s) encontrado(s).")
+        sys.exit(1)
+    print("> Tudo certo.")
@@ -1,7 +1,22 @@
-import pandas as pd
+from __future__ import annotations  # só até o Python 3.10 (PEP 563)
+
+import pathlib
+from typing import TYPE_CHECKING
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+from gab import Gab
+
+# O pandas só é importado dentro das funções que devolvem DataFrames:
+# o grade.py usa o `salvar_npz' (que funciona com uma tabela.Tabela) e
+# não deve pagar o tempo de importação dele.
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 def pauta_com_notas(path='pauta_com_notas.csv'):
+    import pandas as pd
     df = pd.read_csv(
         path,
         index_col='numeracao',
@@ -18,3 +33,545 @@ def pauta_com_notas(path='pauta_com_notas.csv'):
     global num_items
     num_items = len(df['perm'].iloc[0].split('-'))
     return df
+
+
+# Código usado nas matrizes de respostas para o "Não sei." (e para as
+# questões em branco, que o grade.py também grava como 'N').
+NAOSEI = -1
+
+# Bit usado nas máscaras do gabarito para o "Não sei.". As letras 'A',
+# 'B', 'C', ... usam os bits 0, 1, 2, ...
+NAOSEI_BIT = 15
+
+
+class Matrizes(NamedTuple):
+    """Colunas `perm', `respostas' e `gabarito' de uma pauta com notas,
+    já convertidas para matrizes (uma linha por aluno, uma coluna por
+    questão).
+
+    Todas as matrizes estão no espaço das questões *originais* (a
+    coluna j é a questão j do .ate), e as alternativas estão no espaço
+    de letras da prova de cada aluno (que é o que o aluno viu).
+    """
+    perm: np.ndarray       # perm[s, k]: questão original na posição k
+    respostas: np.ndarray  # índice da letra marcada, ou NAOSEI
+    gabarito: np.ndarray   # máscara de bits das letras corretas
+    validas: np.ndarray    # alunos que têm respostas (bool)
+
+
+def _coluna(df, c: str) -> list:
+    """Coluna `c' de `df' (um DataFrame ou uma tabela.Tabela) como
+    lista, com None nos valores faltando."""
+    col = df[c]
+    if not isinstance(col, list):  # pandas.Series
+        col = col.astype(object).where(col.notna(), None).tolist()
+    return [None if isinstance(x, float) and np.isnan(x) else x
+            for x in col]
+
+
+def _split_letras(col: list, num_items: int) -> np.ndarray:
+    """Separa strings do tipo "A-BC-N" numa matriz de códigos Unicode
+    com shape (alunos, num_items, max_letras). Posições vazias são 0
+    (assim como os valores None)."""
+    vazio = [''] * num_items
+    partes = [vazio if x is None else str(x).split('-') for x in col]
+    for p in partes:
+        if len(p) != num_items:
+            raise ValueError(
+                f"Esperava {num_items} questões, encontrei {len(p)}.")
+    arr = np.array(partes, dtype=str).reshape(len(partes), num_items)
+    max_letras = max(arr.dtype.itemsize // 4, 1)
+    arr = arr.astype(f'U{max_letras}', order='C')
+    return arr.view(np.int32).reshape(*arr.shape, max_letras)
+
+
+def matrizes(df, num_items: Optional[int] = None) -> Matrizes:
+    """Lê as colunas `perm', `respostas' e `gabarito' uma única vez e
+    devolve as matrizes correspondentes (ver `Matrizes'). `df' pode ser
+    um DataFrame ou uma tabela.Tabela.
+
+    Se a pauta não tiver nenhuma linha, as matrizes têm zero linhas e
+    `num_items' colunas (que então precisa ser dado)."""
+    perm = [str(p).split('-') for p in _coluna(df, 'perm')]
+    if not perm:
+        if num_items is None:
+            raise ValueError("Pauta vazia: passe o num_items.")
+        perm = np.empty((0, num_items), dtype=int)
+    perm = np.array(perm, dtype=int)
+    num_alunos, n = perm.shape
+    respostas = _coluna(df, 'respostas')
+    validas = np.array([x is not None for x in respostas], dtype=bool)
+
+    # Respostas: uma letra por questão
+    codigos = _split_letras(respostas, n)[:, :, 0]
+    resp = np.where(codigos == ord('N'), NAOSEI, codigos - ord('A'))
+
+    # Gabarito: zero ou mais letras por questão
+    codigos = _split_letras(_coluna(df, 'gabarito'), n)
+    bits = np.where(codigos == ord('N'), NAOSEI_BIT,
+                    codigos - ord('A'))
+    gab = np.where(codigos > 0, 1 << np.clip(bits, 0, None), 0)
+    gab = gab.sum(axis=-1)
+
+    # Alunos sem respostas ficam com "Não sei." em tudo e gabarito vazio
+    resp[~validas] = NAOSEI
+    gab[~validas] = 0
+
+    # Reordena as colunas do espaço da prova do aluno para o espaço das
+    # questões originais.
+    alunos = np.arange(num_alunos)[:, None]
+    resp_orig = np.empty(resp.shape, dtype=np.int8)
+    resp_orig[alunos, perm] = resp
+    gab_orig = np.empty(gab.shape, dtype=np.uint16)
+    gab_orig[alunos, perm] = gab
+
+    return Matrizes(perm=perm.astype(np.int16),
+                    respostas=resp_orig,
+                    gabarito=gab_orig,
+                    validas=validas)
+
+
+def _certas(resp: np.ndarray, gab: np.ndarray) -> np.ndarray:
+    """Máscara das respostas que estão no gabarito."""
+    bit = np.where(resp == NAOSEI, NAOSEI_BIT, resp)
+    return (gab.astype(np.int64) >> bit) & 1 == 1
+
+
+def _correlacao(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """Correlação de Pearson entre x[:, ...] e y[:, ...], calculada ao
+    longo do primeiro eixo (alunos). Dá NaN onde x ou y é constante."""
+    x = x - x.mean(axis=0)
+    y = y - y.mean(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (x * y).sum(axis=0) / np.sqrt(
+            (x**2).sum(axis=0) * (y**2).sum(axis=0))
+
+
+def estatisticas_por_questao(dados: Union[pd.DataFrame, Matrizes],
+                             frac_grupos: float = 0.27) -> pd.DataFrame:
+    """Estatísticas de cada questão (original) da prova.
+
+    `dados' pode ser a pauta com notas (DataFrame) ou as `Matrizes'
+    correspondentes (e.g. as lidas com `resultados_npz').
+
+    Colunas do DataFrame retornado (uma linha por questão):
+    * `certas', `erradas', `naosei': contagens, com a mesma convenção
+      do Report.ipynb (um "Não sei." que esteja no gabarito conta como
+      certa e também como "Não sei.");
+    * `validas': quantidade de alunos com respostas;
+    * `dificuldade': fração de acertos (índice de facilidade `p');
+    * `discriminacao': fração de acertos entre os `frac_grupos' alunos
+      com mais acertos no total, menos a fração de acertos entre os
+      `frac_grupos' com menos acertos;
+    * `ponto_bisserial': correlação entre acertar a questão e o total
+      de acertos nas *outras* questões.
+    """
+    import pandas as pd
+    m = dados if isinstance(dados, Matrizes) else matrizes(dados)
+    resp = m.respostas[m.validas]
+    gab = m.gabarito[m.validas]
+
+    naosei = resp == NAOSEI
+    certas = _certas(resp, gab)
+    erradas = ~naosei & ~certas
+
+    num_validas = len(resp)
+    acertos = certas.sum(axis=1)
+
+    # Grupos superior e inferior, pelo total de acertos
+    tam_grupo = max(int(round(frac_grupos * num_validas)), 1)
+    ordem = np.argsort(acertos, kind='stable')
+    inferior = certas[ordem[:tam_grupo]].mean(axis=0)
+    superior = certas[ordem[-tam_grupo:]].mean(axis=0)
+
+    # Correlação item-resto
+    r_pb = _correlacao(certas, acertos[:, None] - certas)
+
+    return pd.DataFrame({
+        'certas': certas.sum(axis=0),
+        'erradas': erradas.sum(axis=0),
+        'naosei': naosei.sum(axis=0),
+        'validas': num_validas,
+        'dificuldade': certas.mean(axis=0),
+        'discriminacao': superior - inferior,
+        'ponto_bisserial': r_pb,
+    })
+
+
+# Versão do formato do arquivo .npz de resultados
+VERSAO_NPZ = 1
+
+# Colunas da pauta com notas que vão para o .npz como estão (as colunas
+# perm, respostas e gabarito vão como matrizes)
+_COLUNAS_NPZ = ['chamada', 'email', 'dre', 'nomecompleto', 'status']
+
+
+class Resultados(NamedTuple):
+    """Conteúdo de um arquivo .npz de resultados."""
+    df: pd.DataFrame  # pauta, sem as colunas perm/respostas/gabarito
+    matrizes: Matrizes
+    num_items: int
+
+
+def salvar_npz(df, path='pauta_com_notas.npz',
+               num_items: Optional[int] = None):
+    """Salva a pauta com notas num .npz com matrizes de inteiros, que
+    pode ser lido com `resultados_npz' sem fazer parsing de strings.
+
+    `df' pode ser tanto a pauta lida com `pauta_com_notas' quanto a
+    pauta do jeito que o grade.py monta (uma tabela.Tabela com objetos
+    `Respostas' na coluna `respostas'). O `num_items' só é usado se a
+    pauta estiver vazia (ver `matrizes').
+    """
+    m = matrizes(df, num_items)
+    colunas = {
+        c: np.array(['' if x is None else str(x)
+                     for x in _coluna(df, c)], dtype=str)
+        for c in _COLUNAS_NPZ
+    }
+    nota = [np.nan if x is None else float(x)
+            for x in _coluna(df, 'nota')]
+    np.savez_compressed(
+        path,
+        versao=np.array(VERSAO_NPZ),
+        num_items=np.array(m.perm.shape[1]),
+        numeracao=np.asarray(df.index, dtype=np.int64),
+        nota=np.array(nota, dtype=float),
+        **colunas,
+        **m._asdict(),
+    )
+
+
+def resultados_npz(path='pauta_com_notas.npz') -> Resultados:
+    """Lê um .npz gerado por `salvar_npz'."""
+    import pandas as pd
+    with np.load(path, allow_pickle=False) as npz:
+        versao = int(npz['versao'])
+        if versao != VERSAO_NPZ:
+            raise ValueError(
+                f"{path}: versão {versao} do formato não suportada.")
+        m = Matrizes(**{c: npz[c] for c in Matrizes._fields})
+        df = pd.DataFrame(
+            {c: pd.array(npz[c], dtype='string') for c in _COLUNAS_NPZ},
+            index=pd.Index(npz['numeracao'], name='numeracao'),
+        )
+        df = df.replace('', pd.NA)
+        df['nota'] = npz['nota']
+        num_items = int(npz['num_items'])
+    return Resultados(df=df, matrizes=m, num_items=num_items)
+
+
+###
+### Várias provas (P1, P2, P3, de várias turmas e semestres)
+###
+
+# Colunas de cada pauta com notas usadas na análise longitudinal
+_COLUNAS_LONGITUDINAL = ['chamada', 'dre', 'nomecompleto', 'status', 'nota']
+
+
+def _iter_provas(paths: Iterable) -> Iterable[pd.DataFrame]:
+    """Lê, um de cada vez, somente as colunas necessárias de cada
+    arquivo de resultados (.csv ou .npz)."""
+    import pandas as pd
+    for path in paths:
+        path = pathlib.Path(path)
+        if path.suffix == '.npz':
+            df = resultados_npz(path).df.reset_index(drop=True)
+        else:
+            df = pd.read_csv(
+                path,
+                usecols=_COLUNAS_LONGITUDINAL,
+                dtype={
+                    'chamada': 'category',
+                    'dre': 'string',
+                    'nomecompleto': 'string',
+                    'status': 'category',
+                },
+            )
+        yield df[_COLUNAS_LONGITUDINAL]
+
+
+def provas(paths: Iterable) -> pd.DataFrame:
+    """Junta os resultados de várias provas num único DataFrame, com
+    índice (chamada, dre).
+
+    Vários arquivos podem ter a mesma chamada (e.g. uma P1 aplicada em
+    vários lotes ou turmas), mas um mesmo DRE não pode aparecer duas
+    vezes na mesma chamada. As colunas `chamada' e `status' são
+    categóricas.
+    """
+    import pandas as pd
+    df = pd.concat(_iter_provas(paths), ignore_index=True)
+    for c in 'chamada', 'status':
+        df[c] = df[c].astype('category')
+    df = df.set_index(['chamada', 'dre']).sort_index()
+    repetidos = df.index.duplicated(keep=False)
+    if repetidos.any():
+        raise ValueError(
+            f"DREs repetidos na mesma chamada:\n"
+            f"{df.loc[repetidos, ['nomecompleto', 'status']]}")
+    return df
+
+
+def notas_por_aluno(provas_df: pd.DataFrame,
+                    pesos: Optional[Dict[str, float]] = None,
+                    faltas_como_zero: bool = True) -> pd.DataFrame:
+    """Tabela com um aluno (DRE) por linha e uma prova (chamada) por
+    coluna, a partir do DataFrame retornado por `provas'.
+
+    Também calcula a coluna `media', ponderada por `pesos' (um dict
+    chamada -> peso; o default é peso 1 para todas as chamadas). Se
+    `faltas_como_zero', as provas que o aluno não fez (ou nas quais ele
+    não estava na pauta) contam como zero na média; se não, entram na
+    média somente as provas que ele fez.
+    """
+    import pandas as pd
+    notas = provas_df['nota'].unstack('chamada')
+    notas.columns = notas.columns.astype(str)
+    if pesos is None:
+        pesos = {c: 1.0 for c in notas.columns}
+    faltando = set(pesos) - set(notas.columns)
+    if faltando:
+        raise KeyError(f"Chamadas sem resultados: {sorted(faltando)}")
+    w = pd.Series(pesos, dtype=float)
+    n = notas[w.index]
+    if faltas_como_zero:
+        media = n.fillna(0) @ w / w.sum()
+    else:
+        media = (n.fillna(0) @ w) / (n.notna().astype(float) @ w)
+    nomes = provas_df['nomecompleto'].groupby(level='dre').first()
+    notas.insert(0, 'nomecompleto', nomes)
+    notas['media'] = media
+    return notas
+
+
+###
+### Análise de itens no espaço das alternativas originais (do .ate)
+###
+
+def permutacoes(gab: Gab,
+                nomes: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Permutações das questões e das alternativas de cada aluno, a
+    partir do .gab.
+
+    Retorna (q, p), onde q[s, k] é a questão original na posição k da
+    prova do aluno s (o mesmo que a coluna `perm' da pauta com notas), e
+    p tem shape (alunos, num_items, max_num_ans), tal que p[s, j, i] é a
+    alternativa original que aparece na letra i da questão original j
+    na prova do aluno s. A posição do "Não sei." (se houver) é mapeada
+    nela mesma, e posições que não existem naquela questão ficam com -1.
+    """
+    testes = {}
+    for t in gab.iter_tests():
+        if not t.st:
+            continue
+        if t.st.nome in testes:
+            raise KeyError(f"Mais de um {t.st.nome} no .gab")
+        testes[t.st.nome] = t
+    nomes = list(nomes)
+    q = np.empty((len(nomes), gab.num_items), dtype=np.int16)
+    p = np.full((len(nomes), gab.num_items, gab.max_num_ans), -1,
+                dtype=np.int8)
+    for s, nome in enumerate(nomes):
+        if nome not in testes:
+            raise KeyError(f"Nome {nome} não encontrado no .gab")
+        t = testes[nome]
+        q[s] = t.perm
+        for j, item in zip(t.perm, t.items):
+            p[s, j, :len(item.perm)] = item.perm
+            if gab.dont_know:
+                p[s, j, len(item.perm)] = len(item.perm)
+    return q, p
+
+
+def _escolhas_originais(df, m: Matrizes,
+                        gab: Gab) -> Tuple[np.ndarray, np.ndarray]:
+    """Alternativa original (do .ate) escolhida por cada aluno com
+    respostas (`m.validas') em cada questão original, desfazendo o
+    embaralhamento com as permutações do .gab.
+
+    Retorna (orig, dk), onde orig tem shape (alunos válidos, num_items)
+    e dk[j] é a posição do "Não sei." (e das questões em branco) na
+    questão j."""
+    nomes = [x for x, v in zip(_coluna(df, 'nomecompleto'), m.validas)
+             if v]
+    resp = m.respostas[m.validas].astype(np.int64)
+    q, p = permutacoes(gab, nomes)
+
+    # Confere que a pauta e o .gab têm as mesmas permutações de questões
+    if not (m.perm[m.validas] == q).all():
+        raise ValueError("Pauta não bate com o Gab (permutações "
+                         "diferentes)")
+
+    num_ans = np.array(gab.list_of_num_ans())
+    dk = num_ans - 1 if gab.dont_know else num_ans
+    letra = np.where(resp == NAOSEI, dk, resp)
+    if (letra >= gab.max_num_ans).any():
+        raise ValueError("Resposta fora do range das alternativas.")
+    orig = np.take_along_axis(p, letra[:, :, None], axis=2)[:, :, 0]
+    return orig, dk
+
+
+def analise_de_itens(df: pd.DataFrame, gab: Gab) -> pd.DataFrame:
+    """Frequência de escolha de cada alternativa *original* de cada
+    questão, usando as permutações guardadas no .gab para desfazer o
+    embaralhamento das letras.
+
+    `df' é a pauta com notas (só os alunos com respostas são usados).
+    Retorna um DataFrame com índice (questão, alternativa), ambos no
+    espaço do .ate (a alternativa 'A' é a que era a correta no .ate, e
+    'N' é o "Não sei." e as questões em branco), e colunas:
+    * `escolhas': quantidade de alunos que marcaram a alternativa;
+    * `proporcao': fração dos alunos com respostas;
+    * `correta': se a alternativa está no gabarito (já com adendos);
+    * `ponto_bisserial': correlação entre marcar a alternativa e o total
+      de acertos na prova. Para os distratores, espera-se um valor
+      negativo.
+    """
+    import pandas as pd
+    m = matrizes(df)
+    orig, dk = _escolhas_originais(df, m, gab)
+    num_alunos, n = orig.shape
+    num_ans = np.array(gab.list_of_num_ans())
+
+    # Matriz (alunos, questões, alternativas) de escolhas
+    alternativas = np.arange(gab.max_num_ans)
+    escolhas = orig[:, :, None] == alternativas
+
+    acertos = _certas(m.respostas[m.validas], m.gabarito[m.validas])
+    acertos = acertos.sum(axis=1)
+    r_pb = _correlacao(escolhas, acertos[:, None, None])
+
+    letras = [chr(ord('A') + i) for i in alternativas]
+    existe = alternativas < num_ans[:, None]
+    if gab.dont_know:
+        existe &= alternativas != dk[:, None]
+    linhas = []
+    for j in range(n):
+        for i in alternativas[existe[j]]:
+            linhas.append((j, letras[i], i))
+        if gab.dont_know:
+            linhas.append((j, 'N', dk[j]))
+    js = np.array([x[0] for x in linhas], dtype=int)
+    iis = np.array([x[2] for x in linhas], dtype=int)
+    contagens = escolhas.sum(axis=0)
+    return pd.DataFrame(
+        {
+            'escolhas': contagens[js, iis],
+            'proporcao': contagens[js, iis] / max(num_alunos, 1),
+            'correta': [gab.keys[j].get(i) for j, i in zip(js, iis)],
+            'ponto_bisserial': r_pb[js, iis],
+        },
+        index=pd.MultiIndex.from_arrays(
+            [js, [x[1] for x in linhas]],
+            names=['questao', 'alternativa']),
+    )
+
+
+###
+### Respostas erradas iguais (triagem de possível cola)
+###
+
+def _indicadoras(orig: np.ndarray, mascara: np.ndarray,
+                 max_num_ans: int) -> np.ndarray:
+    """Matriz 0/1 (alunos, questões * alternativas), com 1 na coluna
+    (j, orig[s, j]) se mascara[s, j]. Em float32, o produto de duas
+    dessas matrizes conta as escolhas iguais exatamente (são inteiros
+    pequenos) e usa o BLAS."""
+    num_alunos, n = orig.shape
+    x = np.zeros((num_alunos, n * max_num_ans), dtype=np.float32)
+    s, j = np.nonzero(mascara)
+    x[s, j * max_num_ans + orig[s, j]] = 1
+    return x
+
+
+def respostas_parecidas(df, gab: Gab, top: int = 100,
+                        bloco: int = 1024) -> pd.DataFrame:
+    """Os `top' pares de alunos com mais respostas erradas iguais (a
+    mesma alternativa *original* errada na mesma questão original),
+    para triagem de possível cola. As letras de cada prova são
+    desembaralhadas com as permutações do .gab, como no
+    `analise_de_itens'; "Não sei." e questões em branco não contam.
+
+    Todos os pares são comparados, com produtos de matrizes feitos em
+    blocos de `bloco' alunos (a memória usada é proporcional a
+    `bloco' vezes a quantidade de alunos).
+
+    `df' é a pauta com notas (só os alunos com respostas são usados).
+    Retorna um DataFrame com índice (numeracao_1, numeracao_2), em
+    ordem decrescente de `erradas_iguais', e colunas:
+    * `nomecompleto_1', `nomecompleto_2';
+    * `erradas_iguais': questões em que os dois marcaram a mesma
+      alternativa errada;
+    * `esperado': quantas seriam esperadas ao acaso, dadas as questões
+      que os dois erraram e a proporção de escolha de cada alternativa
+      errada entre os alunos que erraram cada questão;
+    * `erradas_1', `erradas_2': questões erradas por cada um;
+    * `iguais': questões em que os dois marcaram a mesma alternativa
+      (certa ou errada).
+    """
+    import pandas as pd
+    m = matrizes(df)
+    orig, _ = _escolhas_originais(df, m, gab)
+    resp = m.respostas[m.validas]
+    marcou = resp != NAOSEI
+    erradas = marcou & ~_certas(resp, m.gabarito[m.validas])
+    num_alunos, n = orig.shape
+    x = _indicadoras(orig, erradas, gab.max_num_ans)
+    contagens = x.sum(axis=0, dtype=np.int64)
+    x = x[:, contagens > 0]  # só as alternativas erradas escolhidas
+
+    # Pares (s, t), s < t, com mais erradas iguais (e ao menos uma).
+    # Cada bloco de linhas é comparado com todos os alunos, e só os
+    # `top' maiores de cada bloco são guardados. O desempate é pelo par
+    # (s, t) menor, para que o resultado não dependa do tamanho do
+    # bloco (o flatnonzero devolve os pares nessa ordem).
+    vazio = np.empty(0, dtype=np.intp)
+    valores, pares = [vazio], [vazio]
+    for a in range(0, num_alunos, bloco):
+        b = min(a + bloco, num_alunos)
+        iguais = (x[a:b] @ x.T).astype(np.intp)
+        iguais[np.arange(a, b)[:, None] >= np.arange(num_alunos)] = 0
+        # Maior valor v (ao menos 1) com `top' pares valendo >= v
+        acima = np.cumsum(np.bincount(iguais.ravel())[::-1])[::-1]
+        v = max(np.flatnonzero(acima >= top)[-1]
+                if acima[0] >= top else 0, 1)
+        maiores = np.flatnonzero(iguais > v)
+        iguais_v = np.flatnonzero(iguais == v)[:top - len(maiores)]
+        idx = np.concatenate([maiores, iguais_v])
+        valores.append(iguais.ravel()[idx])
+        pares.append(a * num_alunos + idx)
+    valores, pares = np.concatenate(valores), np.concatenate(pares)
+    ordem = np.lexsort((pares, -valores))[:top]
+    valores, pares = valores[ordem], pares[ordem]
+    s, t = pares // num_alunos, pares % num_alunos
+
+    # Colunas só dos pares escolhidos
+    escolhidas = _indicadoras(orig, marcou, gab.max_num_ans)
+    # Chance de dois alunos que erraram a questão j terem marcado a
+    # mesma alternativa errada
+    contagens = contagens.reshape(n, gab.max_num_ans)
+    total = contagens.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        coincidencia = np.nan_to_num(
+            (contagens**2).sum(axis=1) / total**2)
+    numeracao = np.asarray(df.index)[m.validas]
+    nomes = np.array([nome for nome, v in zip(_coluna(df, 'nomecompleto'),
+                                              m.validas) if v],
+                     dtype=object)
+    return pd.DataFrame(
+        {
+            'nomecompleto_1': nomes[s],
+            'nomecompleto_2': nomes[t],
+            'erradas_iguais': valores,
+            'esperado': ((erradas[s] & erradas[t])
+                         * coincidencia).sum(axis=1),
+            'erradas_1': erradas[s].sum(axis=1),
+            'erradas_2': erradas[t].sum(axis=1),
+            'iguais': (escolhidas[s] * escolhidas[t]).sum(axis=1)
+                      .astype(np.int64),
+        },
+        index=pd.MultiIndex.from_arrays(
+            [numeracao[s], numeracao[t]],
+            names=['numeracao_1', 'numeracao_2']),
+    )
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+# ./review_server.py --help
+
+import sys
+import json
+import time
+import pathlib
+import argparse
+import threading
+import collections
+import http.server
+import urllib.parse
+from typing import List, NamedTuple, Optional, Tuple
+
+from gab import Gab, MCTest, MCKey
+from grade import Respostas, read_gabs
+from tabela import Tabela
+
+assert sys.version_info >= (3, 8)
+
+
+# TODO: tornar o 'colorama' obrigatório.
+try:
+    from colorama import init, Fore, Style
+except ModuleNotFoundError:
+    def init():
+        global Fore, Style
+        global args
+        fore_dict = {
+            'RED': "\033[91m",
+        }
+        style_dict = {
+            'RESET_ALL': "\033[0m",
+        }
+        if not args.use_colors:
+            for d in fore_dict, style_dict:
+                for k in d:
+                    d[k] = ""
+        else:
+            print("WARNING: faça 'pip install colorama' para que as "
+                  "cores funcionem de forma cross-platform.",
+                  file=sys.stderr)
+        TermColors_Fore = collections.namedtuple(
+            "TermColors_Fore", fore_dict.keys())
+        Fore = TermColors_Fore(*fore_dict.values())
+        TermColors_Style = collections.namedtuple(
+            "TermColors_Style", style_dict.keys())
+        Style = TermColors_Style(*style_dict.values())
+
+
+def warn(txt):
+    print(f"{Fore.RED}WARNING:{Style.RESET_ALL} {txt}",
+          file=sys.stderr)
+
+
+###
+### Estado carregado na memória
+###
+
+class Estado(NamedTuple):
+    """Tudo o que as consultas usam. Nunca é alterado: quando um adendo
+    ou a pauta mudam, um Estado novo substitui o antigo de uma vez, e
+    as consultas em andamento continuam usando o antigo."""
+    gab: Gab
+    adendos: List[pathlib.Path]
+    pauta: Tabela
+    # chave (numeração, DRE, email ou nome completo) -> posição na pauta
+    busca: dict
+
+
+def file_signature(path):
+    """O que muda quando o arquivo é alterado (ou criado, ou apagado)."""
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def find_addenda(adendos, adendos_dirs) -> List[pathlib.Path]:
+    """Os adendos explícitos (--addendum), na ordem, seguidos dos .adg de
+    cada --addenda-dir, em ordem alfabética."""
+    paths = list(adendos)
+    for d in adendos_dirs:
+        paths.extend(sorted(d.glob('*.adg')))
+    return paths
+
+
+def read_pauta(path) -> Tuple[Tabela, dict]:
+    pauta = Tabela.read_csv(path, index_col='numeracao')
+    busca = {}
+    for col in 'nomecompleto', 'email', 'dre':
+        busca.update((v, i) for i, v in enumerate(pauta[col])
+                     if v is not None)
+    busca.update((str(n), i) for i, n in enumerate(pauta.index))
+    return pauta, busca
+
+
+def with_addenda(base: Gab, base_keys: List[MCKey], adendos) -> Gab:
+    """Uma cópia rasa do `base' (os testes são os mesmos), com as chaves
+    originais `base_keys' alteradas pelos adendos."""
+    g = Gab(base.fmt, base.num_tests, base.num_items, base.max_num_ans,
+            base.dont_know)
+    g.testes_com_nome = base.testes_com_nome
+    g.testes_sem_nome = base.testes_sem_nome
+    g.keys = [MCKey(k.items, k.length) for k in base_keys]
+    diff = g.update_from_addenda(adendos)
+    for item, antes, depois in diff:
+        print(f"  . item {item + 1}: {antes or '-'} -> {depois or '-'}")
+    return g
+
+
+###
+### Consultas
+###
+
+def parse_respostas(respostas: Optional[str], test: MCTest):
+    """O contrário do str(Respostas): 'A-N-C-...' (como na coluna
+    `respostas' da pauta com notas) de volta para um Respostas. Resposta
+    em branco e "Não sei." ficam iguais ('N'), mas valem o mesmo na
+    correção."""
+    if respostas is None:
+        return None
+    lst = [f"({x.lower()})" if x != 'N' else "Não sei."
+           for x in respostas.split('-')]
+    return Respostas(lst, [it.num_answers for it in test.items])
+
+
+def test_keys(test: MCTest, g: Gab) -> List[str]:
+    """Letras certas de cada questão, na ordem da prova do aluno."""
+    return [g.keys[q].perm_letras(item.perm,
+                                  last_is_dk=Respostas.last_is_dk)
+            for q, item in zip(test.perm, test.items)]
+
+
+def lookup(estado: Estado, chave: str) -> Optional[dict]:
+    """Tudo sobre a prova de um aluno (buscado pela numeração, DRE,
+    email ou nome completo), ou None se ele não estiver na pauta.
+
+    A `nota' e o `gabarito' são os da pauta com notas; `nota_atual' e
+    `gabarito_atual' são calculados com as chaves atuais (i.e. com os
+    adendos adicionados depois da correção)."""
+    i = estado.busca.get(chave)
+    if i is None:
+        return None
+    pauta, g = estado.pauta, estado.gab
+    row = {c: pauta[c][i] for c in pauta.columns}
+    test = g.get_test_by_st_name(row['nomecompleto'])
+    respostas = parse_respostas(row.get('respostas'), test)
+    letras = row['respostas'].split('-') if respostas else None
+    chaves = test_keys(test, g)
+    result = {
+        'numeracao': pauta.index[i],
+        **row,
+        'nota': float(row['nota']) if row.get('nota') else None,
+        'perm': test.perm.to_csv_string(),
+        'gabarito_atual': '-'.join(chaves),
+        'nota_atual': None,
+        'questoes': [
+            {
+                'questao_original': q + 1,
+                # alternativa original de cada letra da prova do aluno
+                'alternativas_originais': ''.join(
+                    chr(ord('A') + p) for p in item.perm),
+                'gabarito': c,
+                'resposta': letras[j] if letras else None,
+            }
+            for j, (q, item, c) in enumerate(
+                zip(test.perm, test.items, chaves))
+        ],
+    }
+    if row['status'] in ('only_empty_attempts', 'no_positive_attempts'):
+        result['nota_atual'] = 0.0  # como no grade.py
+    elif respostas is not None:
+        result['nota_atual'], _ = respostas.grade(test, g.keys)
+    return result
+
+
+def keys_summary(estado: Estado) -> dict:
+    g = estado.gab
+    return {
+        'chaves': [k.letras(last_is_dk=g.dont_know) or '-'
+                   for k in g.keys],
+        'adendos': [str(p) for p in estado.adendos],
+        'alunos': len(estado.pauta),
+    }
+
+
+###
+### Servidor
+###
+
+class ReviewServer(http.server.ThreadingHTTPServer):
+    """Servidor HTTP com o Estado carregado. Uma thread confere, a cada
+    `poll' segundos, se algum adendo (ou a pauta) mudou, e recarrega."""
+
+    daemon_threads = True
+
+    def __init__(self, address, pauta_path, gab: Gab, adendos,
+                 adendos_dirs, poll: float):
+        super().__init__(address, RequestHandler)
+        self.pauta_path = pauta_path
+        self.base = gab
+        self.base_keys = [MCKey(k.items, k.length) for k in gab.keys]
+        self.adendos = adendos
+        self.adendos_dirs = adendos_dirs
+        self.poll = poll
+        self.verbose = False
+        self.assinaturas = None
+        self.falhou = None
+        self.estado = None
+        self.reload()
+        threading.Thread(target=self.watch, daemon=True).start()
+
+    def signatures(self, adendos):
+        return ([(p, file_signature(p)) for p in adendos],
+                file_signature(self.pauta_path))
+
+    def reload(self) -> None:
+        """Recarrega o que tiver mudado. Se der erro (e.g. um .adg ainda
+        sendo escrito), mantém o Estado anterior e tenta de novo quando
+        os arquivos mudarem de novo."""
+        adendos = find_addenda(self.adendos, self.adendos_dirs)
+        assinaturas = self.signatures(adendos)
+        if assinaturas in (self.assinaturas, self.falhou):
+            return
+        antes = self.estado
+        try:
+            if antes is None or assinaturas[0] != self.assinaturas[0]:
+                print(f"> Aplicando {len(adendos)} adendo(s)...")
+                g = with_addenda(self.base, self.base_keys, adendos)
+            else:
+                g = antes.gab
+            if antes is None or assinaturas[1] != self.assinaturas[1]:
+                print(f"> Lendo {self.pauta_path}...")
+                pauta, busca = read_pauta(self.pauta_path)
+            else:
+                pauta, busca = antes.pauta, antes.busca
+        except Exception as e:  # qualquer erro: a thread do watch segue
+            if antes is None:
+                raise
+            warn(f"Mantendo o estado anterior: {e}")
+            self.falhou = assinaturas  # até o arquivo mudar de novo
+            return
+        self.estado = Estado(g, adendos, pauta, busca)
+        self.assinaturas = assinaturas
+
+    def watch(self):
+        while True:
+            time.sleep(self.poll)
+            self.reload()
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    """GET /aluno/<numeração, DRE, email ou nome>: a prova do aluno.
+    GET /chaves: as chaves atuais e os adendos aplicados."""
+
+    protocol_version = 'HTTP/1.1'  # mantém a conexão aberta
+    # Sem isso, com a conexão aberta, cada resposta (cabeçalho e corpo
+    # em dois write) espera uns 40 ms pelo ACK atrasado do cliente.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        estado = self.server.estado
+        partes = urllib.parse.unquote(self.path).strip('/').split('/', 1)
+        if partes[0] == 'aluno' and len(partes) == 2:
+            try:
+                result = lookup(estado, partes[1])
+            except KeyError as e:  # aluno da pauta sem teste no .gab
+                self.send_json(500, {'erro': str(e)})
+                return
+            if result is None:
+                self.send_json(404, {'erro': f"Aluno '{partes[1]}' não "
+                                             f"está na pauta."})
+            else:
+                self.send_json(200, result)
+        elif partes == ['chaves']:
+            self.send_json(200, keys_summary(estado))
+        else:
+            self.send_json(404, {'erro': "Use /aluno/<chave> ou "
+                                         "/chaves."})
+
+    def send_json(self, code: int, data):
+        body = json.dumps(data, ensure_ascii=False).encode()
+        self.send_response(code)
+        self.send_header('Content-Type',
+                         'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Serviço local (HTTP) para a revisão de prova: lê o "
+                    "gabarito, os adendos e a pauta com notas uma vez só, "
+                    "e responde na hora, para cada aluno, a permutação, "
+                    "as letras certas de cada questão e a nota. Os "
+                    "adendos e a pauta são relidos quando mudam.")
+
+    parser.add_argument(
+        "--no-colors",
+        help="Se não encontrar o pacote 'colorama', não tenta "
+             "usar cores.",
+        action='store_false',
+        dest='use_colors',
+    )
+
+    parser.add_argument(
+        "PAUTA_COM_NOTAS_CSV",
+        help="Pauta com notas gerada pelo grade.py.",
+        type=pathlib.Path,
+    )
+
+    parser.add_argument(
+        "GABARITO",
+        help="Arquivo(s) '.gab' ou '.zip' do AtenaME, como no "
+             "grade.py.",
+        type=pathlib.Path,
+        nargs='+',
+    )
+
+    parser.add_argument(
+        "--addendum",
+        help="Arquivo '.adg' de adendo ao gabarito, como no grade.py "
+             "(pode ser especificada várias vezes).",
+        type=pathlib.Path,
+        action='append',
+        metavar='ADG',
+        dest='adendos',
+        default=[],
+    )
+
+    parser.add_argument(
+        "--addenda-dir",
+        help="Diretório onde os adendos novos vão ser colocados: todos "
+             "os '.adg' dele são aplicados (em ordem alfabética, depois "
+             "dos --addendum), e um '.adg' novo ou alterado é aplicado "
+             "sem reiniciar o serviço. Pode ser especificada várias "
+             "vezes.",
+        type=pathlib.Path,
+        action='append',
+        metavar='DIR',
+        dest='adendos_dirs',
+        default=[],
+    )
+
+    parser.add_argument(
+        "--port",
+        help="Porta (em localhost). O default é 8000.",
+        type=int,
+        default=8000,
+    )
+
+    parser.add_argument(
+        "--poll",
+        help="De quantos em quantos segundos conferir se os adendos ou "
+             "a pauta mudaram. O default é 1.",
+        type=float,
+        default=1.0,
+    )
+
+    parser.add_argument(
+        "--verbose", "-v",
+        help="Mostra cada consulta recebida.",
+        action='store_true',
+    )
+
+    args = parser.parse_args()
+
+    init()  # Inicializa as cores
+
+    print("> Lendo o(s) gabarito(s)...")
+    g = read_gabs(args.GABARITO)
+
+    server = ReviewServer(('127.0.0.1', args.port),
+                          args.PAUTA_COM_NOTAS_CSV, g, args.adendos,
+                          args.adendos_dirs, args.poll)
+    server.verbose = args.verbose
+    print(f"> Pronto: http://127.0.0.1:{args.port}/aluno/<DRE> "
+          f"(Ctrl+C para sair)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 # ./split_pdfs.py --help
 
+import io
 import sys
 import tempfile
 import pathlib
@@ -9,12 +10,21 @@ import shutil
 import subprocess
 import argparse
 import collections
+import contextlib
 from math import log10, floor
 
 import pandas as pd
 
 from pdfrw import PdfReader, PdfWriter, IndirectPdfDict
 
+import instrument
+
+# Opcional: só é usado com as opções --lazy e --compact.
+try:
+    import pypdf
+except ModuleNotFoundError:
+    pypdf = None
+
 # TODO: ler o PDF a partir do ZIP, ao invés de forçar o usuário a baixar
 #       o PDF solto.
 
@@ -70,65 +80,79 @@ def find_name_in_pdf(name, filename):
     return result.returncode == 0
 
 
-if __name__ == "__main__":
-
-    parser = argparse.ArgumentParser(
-        description="Separa o PDF de lote de provas em um para cada "
-                    "DRE.")
-
-    parser.add_argument(
-        "--no-colors",
-        help="Se não encontrar o pacote 'colorama', não tenta "
-             "usar cores.",
-        action='store_false',
-        dest='use_colors',
-    )
-
-    parser.add_argument(
-        "LOTE_PDF",
-        help="Arquivo de lote de provas, gerado pelo AtenaME.",
-        type=pathlib.Path,
-    )
-
-    parser.add_argument(
-        "SKIP_PAGES",
-        help="Quantidade de páginas de lista de presença no início "
-             "do LOTE_PDF, conforme o README.",
-        type=int,
-    )
-
-    parser.add_argument(
-        "PAUTA_CSV",
-        help="Arquivo de pauta gerado pelo moodle_to_atena.py.",
-        type=pathlib.Path,
-    )
-
-    # TODO: criar o known_values.csv automaticamente caso não exista.
-    #       essa opção deve passar a ser opcional
-    parser.add_argument(
-        "KNOWN_VALUES_CSV",
-        help="Tabela de DREs verificados manualmente, conforme "
-             "descrito no README.",
-        type=pathlib.Path,
-    )
-
-    parser.add_argument(
-        "PROVAS_DIR",
-        help="Nome de diretório (inexistente) onde as provas "
-             "serão salvas. O mesmo nome (seguido de .zip) "
-             "será usado para o zip. Leia o README.",
-        type=pathlib.Path,
-    )
-
-    args = parser.parse_args()
-
-    init()  # Inicializa as cores
-
-    ### Lê o arquivo de pauta
+def find_numbers_in_pdf(filename):
+    """Roda o pdfgrep uma única vez no PDF inteiro, e retorna um dict
+    que diz quais números (sequências de dígitos) aparecem em cada
+    página (numeradas a partir de 1)."""
+    result = subprocess.run(
+        ['pdfgrep', '--page-number', '--no-filename', '--only-matching',
+         '[0-9]+', os.fspath(filename)],
+        stdout=subprocess.PIPE, universal_newlines=True)
+    if result.returncode > 1:  # 1 quer dizer "nada encontrado"
+        raise RuntimeError(f"Erro ao rodar o pdfgrep em {filename}.")
+    numbers = collections.defaultdict(set)
+    for line in result.stdout.splitlines():
+        pgnum, _, token = line.partition(':')
+        numbers[int(pgnum)].add(token.strip())
+    return numbers
+
+
+def page_text_lazy(reader, pgnum):
+    """O texto da página `pgnum' (a partir de 1) do lote aberto no
+    `reader' (um pypdf.PdfReader), com os espaços e quebras de linha
+    juntados num espaço só. Como no write_pages_lazy, o cache do
+    reader é esvaziado no final."""
+    text = reader.pages[pgnum - 1].extract_text() or ''
+    reader.resolved_objects.clear()
+    return ' '.join(text.split())
+
+
+def write_pages_lazy(reader, pgnums, title, filename):
+    """Escreve as páginas `pgnums' (numeradas a partir de 1) do lote
+    aberto no `reader' (um pypdf.PdfReader) num PDF novo. Só os
+    objetos usados por essas páginas são lidos do lote, e o cache do
+    reader é esvaziado no final, para que a memória usada não cresça
+    com o tamanho do lote."""
+    writer = pypdf.PdfWriter()
+    for pgnum in pgnums:
+        writer.add_page(reader.pages[pgnum - 1])
+    writer.add_metadata({'/Title': title})
+    writer.write(os.fspath(filename))
+    reader.resolved_objects.clear()
+
+
+def compact_pdf(filename):
+    """Reescreve o PDF `filename' de forma compacta (com o pypdf):
+    comprime os content streams, junta os objetos idênticos (e.g. a
+    mesma fonte copiada do lote para cada página) e remove os objetos
+    que não são usados. Se o resultado não for menor, o arquivo fica
+    como estava. Retorna o tamanho, em bytes, antes e depois."""
+    before = os.path.getsize(filename)
+    writer = pypdf.PdfWriter(clone_from=os.fspath(filename))
+    for page in writer.pages:
+        page.compress_content_streams()
+    writer.compress_identical_objects()
+    compacted = io.BytesIO()
+    writer.write(compacted)
+    if compacted.tell() >= before:
+        return before, before
+    with open(filename, 'wb') as file:
+        file.write(compacted.getbuffer())
+    return before, compacted.tell()
+
+
+def read_pauta(path) -> pd.DataFrame:
     pauta_atena = pd.read_csv(
-        args.PAUTA_CSV,
+        path,
         index_col='numeracao',
         dtype={'dre': 'string'})
+    check_pauta(pauta_atena)
+    return pauta_atena
+
+
+def check_pauta(pauta_atena: pd.DataFrame):
+    """Confere que os DREs e os emails da pauta são únicos, e avisa se
+    houver nomes repetidos."""
     assert pauta_atena['dre'].is_unique
     assert pauta_atena['email'].is_unique
     if not pauta_atena['nomecompleto'].is_unique:
@@ -138,20 +162,31 @@ if __name__ == "__main__":
         print(masked_df[['email', 'dre', 'nomecompleto']],
               file=sys.stderr)
 
-    ### Lê o arquivo de known values
+
+def read_known_values(path) -> pd.DataFrame:
     known_values = pd.read_csv(
-        args.KNOWN_VALUES_CSV,
+        path,
         index_col='pgnum',
         dtype={'dre': 'string'})
     assert known_values.index.is_unique, \
         "Entradas duplicadas no arquivo de 'known values'."
+    return known_values
 
+
+def split_lote(lote_pdf, skip_pages: int, pauta_atena: pd.DataFrame,
+               known_values: pd.DataFrame, provas_dir,
+               by_dre=False, lazy=False, compact=False) -> pathlib.Path:
+    """Separa o lote em uma prova por DRE da pauta, no diretório
+    (inexistente) `provas_dir', e gera o zip. As opções são as de
+    mesmo nome na linha de comando. Retorna o caminho absoluto do
+    diretório."""
     ### Dict que diz quais páginas do PDF de lote estão associadas
     ### a cada DRE.
     dre_to_pages_map = {dre: [] for dre in pauta_atena['dre']}
 
     ### Faz todo o trabalho dentro de um diretório temporário
-    with tempfile.TemporaryDirectory() as tmpdirname:
+    with tempfile.TemporaryDirectory() as tmpdirname, \
+            contextlib.ExitStack() as stack:
         tmpdir = pathlib.Path(tmpdirname)
 
         ### Cria diretórios dentro do diretório temporário
@@ -163,31 +198,74 @@ if __name__ == "__main__":
         final_dir = tmpdir / "final"
         final_dir.mkdir()
 
-        print("> Separando as páginas...", end='')
-        lote_reader = PdfReader(os.fspath(args.LOTE_PDF))
-        for i, page in enumerate(lote_reader.pages):
-            if i < args.SKIP_PAGES:
-                continue
-            page_writer = PdfWriter()
-            page_writer.addpages([page])
-            page_writer.write(os.fspath(pages_dir / f"{i+1:08}.pdf"))
-        del page_writer, lote_reader, page
+        instrument.begin('separar_paginas')
+        if lazy:
+            print("> Abrindo o lote...", end='')
+            lote_file = stack.enter_context(open(lote_pdf, 'rb'))
+            lote_reader = pypdf.PdfReader(lote_file)
+            num_pages = len(lote_reader.pages)
+        else:
+            print("> Separando as páginas...", end='')
+            lote_reader = PdfReader(os.fspath(lote_pdf))
+            num_pages = len(lote_reader.pages)
+            for i, page in enumerate(lote_reader.pages):
+                if i < skip_pages:
+                    continue
+                page_writer = PdfWriter()
+                page_writer.addpages([page])
+                page_writer.write(os.fspath(pages_dir / f"{i+1:08}.pdf"))
+            del page_writer, lote_reader, page
+        instrument.count('paginas', num_pages)
+        instrument.end()
         print()
 
-        num_files = len(list(pages_dir.iterdir()))
-        num_files_digits = floor(log10(num_files + args.SKIP_PAGES)) + 1
-        for i, filename in enumerate(sorted(pages_dir.iterdir())):
-            pgnum = int(filename.stem)
-            assert i + 1 == pgnum - args.SKIP_PAGES
+        if by_dre:
+            print("> Procurando DREs no lote...", end='')
+            with instrument.stage('procurar_dres'):
+                numbers_by_page = find_numbers_in_pdf(lote_pdf)
+                dre_to_row = {row.dre: row
+                              for row in pauta_atena.itertuples()}
+            print()
+
+        # Sem os arquivos de cada página (--lazy), o texto de cada
+        # página é extraído do lote uma vez só, e cada nome é procurado
+        # nele (todos os nomes presentes são achados, mesmo que um seja
+        # parte de outro, como com o pdfgrep).
+        page_texts = {}
+
+        def name_in_page(name, pgnum):
+            instrument.count('nomes_testados')
+            if not lazy:
+                return find_name_in_pdf(name,
+                                        pages_dir / f"{pgnum:08}.pdf")
+            if pgnum not in page_texts:
+                page_texts.clear()
+                page_texts[pgnum] = page_text_lazy(lote_reader, pgnum)
+            return ' '.join(name.split()) in page_texts[pgnum]
+
+        instrument.begin('procurar_nomes')
+        num_pages_digits = floor(log10(num_pages)) + 1
+        for pgnum in range(skip_pages + 1, num_pages + 1):
+            instrument.count('paginas_procuradas')
             print(f"\r> Procurando nomes em cada página:"
-                  f"{pgnum: {num_files_digits}}"
-                  f"/{num_files + args.SKIP_PAGES}",
+                  f"{pgnum: {num_pages_digits}}/{num_pages}",
                   end='')
             names_found = []
-            for row in pauta_atena.itertuples():
-                if find_name_in_pdf(row.nomecompleto, filename):
-                    names_found.append(row)
+            if by_dre:
+                names_found = [dre_to_row[token] for token in
+                               numbers_by_page.get(pgnum, ())
+                               if token in dre_to_row]
+                if len(names_found) > 1:
+                    # Mais de um DRE na página: desempata pelo nome
+                    names_found = [
+                        row for row in names_found
+                        if name_in_page(row.nomecompleto, pgnum)]
+            if not names_found:
+                for row in pauta_atena.itertuples():
+                    if name_in_page(row.nomecompleto, pgnum):
+                        names_found.append(row)
             if len(names_found) != 1:
+                instrument.count('paginas_do_known_values')
                 for row in known_values.itertuples():
                     if row.Index == pgnum:
                         dre = row.dre
@@ -204,7 +282,8 @@ if __name__ == "__main__":
                     raise ValueError()
             else:
                 dre = names_found[0].dre
-            dre_to_pages_map[dre].append(filename)
+            dre_to_pages_map[dre].append(pgnum)
+        instrument.end()
         print()
 
         ### Verifica que os nomes foram encontrados sequencialmente,
@@ -221,26 +300,47 @@ if __name__ == "__main__":
                 warn(f"O DRE {dre} está presente na pauta, mas não foi "
                      f"encontrado no lote! Ele vai ficar sem prova!")
                 continue
-            this_min = min(
-                int(file.stem) for file in dre_to_pages_map[dre])
-            this_max = max(
-                int(file.stem) for file in dre_to_pages_map[dre])
+            this_min = min(dre_to_pages_map[dre])
+            this_max = max(dre_to_pages_map[dre])
             if prev_max is not None:
                 assert this_min == prev_max + 1
             prev_max = this_max
         print()
 
         print("> Gerando os arquivos finais...", end='')
+        instrument.begin('gerar_provas')
         for dre in dre_to_pages_map:
+            title = f"P1 AlgLin 2020 PLE: {dre}"
+            if lazy:
+                write_pages_lazy(lote_reader, dre_to_pages_map[dre],
+                                 title, final_dir / f"{dre}.pdf")
+                continue
             prova_writer = PdfWriter()
-            for filename in dre_to_pages_map[dre]:
-                prova_writer.addpages(PdfReader(filename).pages)
-            prova_writer.trailer.Info = IndirectPdfDict(
-                Title=f"P1 AlgLin 2020 PLE: {dre}")
+            for pgnum in dre_to_pages_map[dre]:
+                prova_writer.addpages(
+                    PdfReader(pages_dir / f"{pgnum:08}.pdf").pages)
+            prova_writer.trailer.Info = IndirectPdfDict(Title=title)
             prova_writer.write(os.fspath(final_dir / f"{dre}.pdf"))
+        instrument.count('provas', len(dre_to_pages_map))
+        instrument.end()
         print()
 
-        provas_dir = (pathlib.Path() / args.PROVAS_DIR).resolve()
+        if compact:
+            print("> Compactando os arquivos finais...", end='')
+            total_before = total_after = 0
+            with instrument.stage('compactar'):
+                for filename in final_dir.iterdir():
+                    before, after = compact_pdf(filename)
+                    total_before += before
+                    total_after += after
+            instrument.count('bytes_antes_de_compactar', total_before)
+            instrument.count('bytes_depois_de_compactar', total_after)
+            print()
+            print(f"  . {total_before} bytes antes, {total_after} "
+                  f"bytes depois "
+                  f"({100 * total_after / max(total_before, 1):.1f}%)")
+
+        provas_dir = (pathlib.Path() / provas_dir).resolve()
         print(f"> Colocando as provas no diretório {provas_dir} ...",
               end='')
         provas_dir.mkdir()
@@ -252,9 +352,136 @@ if __name__ == "__main__":
         print()
 
     print("> Gerando o zip...", end='')
-    shutil.make_archive(
-        os.fspath(provas_dir), "zip",
-        root_dir=os.fspath(provas_dir.parent),
-        base_dir=os.fspath(provas_dir.name)
-    )
+    with instrument.stage('zip'):
+        shutil.make_archive(
+            os.fspath(provas_dir), "zip",
+            root_dir=os.fspath(provas_dir.parent),
+            base_dir=os.fspath(provas_dir.name)
+        )
     print()
+
+    return provas_dir
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Separa o PDF de lote de provas em um para cada "
+                    "DRE.")
+
+    parser.add_argument(
+        "--no-colors",
+        help="Se não encontrar o pacote 'colorama', não tenta "
+             "usar cores.",
+        action='store_false',
+        dest='use_colors',
+    )
+
+    parser.add_argument(
+        "LOTE_PDF",
+        help="Arquivo de lote de provas, gerado pelo AtenaME.",
+        type=pathlib.Path,
+    )
+
+    parser.add_argument(
+        "SKIP_PAGES",
+        help="Quantidade de páginas de lista de presença no início "
+             "do LOTE_PDF, conforme o README.",
+        type=int,
+    )
+
+    parser.add_argument(
+        "PAUTA_CSV",
+        help="Arquivo de pauta gerado pelo moodle_to_atena.py.",
+        type=pathlib.Path,
+    )
+
+    # TODO: criar o known_values.csv automaticamente caso não exista.
+    #       essa opção deve passar a ser opcional
+    parser.add_argument(
+        "KNOWN_VALUES_CSV",
+        help="Tabela de DREs verificados manualmente, conforme "
+             "descrito no README.",
+        type=pathlib.Path,
+    )
+
+    parser.add_argument(
+        "PROVAS_DIR",
+        help="Nome de diretório (inexistente) onde as provas "
+             "serão salvas. O mesmo nome (seguido de .zip) "
+             "será usado para o zip. Leia o README.",
+        type=pathlib.Path,
+    )
+
+    parser.add_argument(
+        "--by-dre",
+        help="Identifica as páginas pelo DRE impresso nelas: o lote "
+             "inteiro é lido uma vez só, procurando números, e cada "
+             "página fica com o aluno da pauta cujo DRE aparece nela. "
+             "Os nomes só são procurados para desempatar (mais de um "
+             "DRE na página) ou quando nenhum DRE é encontrado.",
+        action='store_true',
+    )
+
+    parser.add_argument(
+        "--lazy",
+        help="Não carrega o lote inteiro na memória, nem separa uma "
+             "página por arquivo: as páginas são lidas do lote (com o "
+             "pacote 'pypdf') só na hora de escrever a prova de cada "
+             "aluno, e os nomes são procurados no texto de cada página "
+             "extraído pelo pypdf. Use para lotes muito grandes.",
+        action='store_true',
+    )
+
+    parser.add_argument(
+        "--compact",
+        help="Compacta a prova de cada aluno (com o pacote 'pypdf'): "
+             "recursos repetidos, como as fontes de cada página, são "
+             "guardados uma vez só, os content streams são "
+             "comprimidos e os objetos não usados são removidos. O "
+             "total de bytes antes e depois é mostrado no final.",
+        action='store_true',
+    )
+
+    parser.add_argument(
+        "--stats",
+        help="Salva num JSON o tempo de cada etapa, alguns contadores "
+             "e o pico de memória (ver instrument.py).",
+        type=pathlib.Path,
+        metavar='JSON',
+    )
+
+    parser.add_argument(
+        "--trace-memory",
+        help="Com --stats, mede também o pico de memória alocada pelo "
+             "Python (com o tracemalloc, que deixa tudo mais lento).",
+        action='store_true',
+    )
+
+    args = parser.parse_args()
+
+    for opt in 'lazy', 'compact':
+        if getattr(args, opt) and pypdf is None:
+            parser.error(f"A opção --{opt} precisa do pacote 'pypdf' "
+                         f"(faça 'pip install pypdf').")
+
+    if args.stats is not None:
+        instrument.enable(args.stats, trace_memory=args.trace_memory)
+
+    init()  # Inicializa as cores
+
+    ### Lê o arquivo de pauta
+    instrument.begin('ler_pauta')
+    pauta_atena = read_pauta(args.PAUTA_CSV)
+
+    ### Lê o arquivo de known values
+    known_values = read_known_values(args.KNOWN_VALUES_CSV)
+    instrument.end()
+
+    split_lote(args.LOTE_PDF, args.SKIP_PAGES, pauta_atena,
+               known_values, args.PROVAS_DIR, by_dre=args.by_dre,
+               lazy=args.lazy, compact=args.compact)
+
+    peak = instrument.peak_rss_mib()
+    if peak is not None:
+        print(f"> Pico de memória: {peak:.1f} MiB")
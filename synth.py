@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+# ./synth.py --help
+
+"""Gera dados sintéticos (mas válidos) para testar e medir o desempenho
+dos scripts sem precisar de dados reais de alunos:
+
+* `PautaAtena.csv', no formato gerado pelo moodle_to_atena.py;
+* `Lote.gab', no formato binário do AtenaME lido pelo gab.py;
+* `Respostas.csv', no formato baixado do Moodle, com várias tentativas
+  por aluno (mas somente padrões de tentativas que o grade.py trata);
+* `Lote.pdf', com as páginas de lista de presença seguidas das
+  páginas das provas, com o nome de cada aluno escrito na página;
+* `known_values.csv', vazio.
+"""
+
+import csv
+import sys
+import random
+import pathlib
+import argparse
+from typing import List
+
+from gab import Gab, MCTest, MCItem, MCKey, _GabReader
+
+assert sys.version_info >= (3, 8)
+
+# Letras usadas nos nomes sintéticos. Os nomes têm pelo menos 3
+# palavras de pelo menos 4 letras, para que um nome nunca seja
+# (na prática) substring de outro quando o split_pdfs.py procura os
+# nomes nas páginas.
+_LETRAS_NOMES = "ABCDEFGHIJLMNOPRSTUVZ"
+
+# Quantos nomes cabem em cada página de lista de presença
+NOMES_POR_PAGINA_PRESENCA = 40
+
+
+###
+### Pauta
+###
+
+def synth_pauta(num_students: int, seed: int = 0,
+                chamada: str = 'P1Bench') -> List[dict]:
+    """Pauta sintética no mesmo formato (lista de dicts) que o
+    moodle_to_atena.py monta antes de escrever os arquivos."""
+    rng = random.Random(seed)
+    pauta = []
+    nomes = set()
+    for i in range(num_students):
+        while True:
+            nome = ' '.join(
+                ''.join(rng.choice(_LETRAS_NOMES)
+                        for _ in range(rng.randint(4, 10)))
+                for _ in range(rng.randint(3, 5)))
+            if nome not in nomes:
+                break
+        nomes.add(nome)
+        pauta.append({
+            'numeracao': 0,
+            'chamada': chamada,
+            'email': f"aluno_{i:06}@example.com",
+            'dre': f"{100000000 + i:09}",
+            'nomecompleto': nome,
+        })
+    pauta = sorted(pauta, key=lambda d: d['nomecompleto'])
+    for i in range(len(pauta)):
+        pauta[i]['numeracao'] = i + 1
+    return pauta
+
+
+def write_pauta_csv(pauta: List[dict], path):
+    with open(path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=list(pauta[0]),
+                                lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(pauta)
+
+
+###
+### Gab
+###
+
+def _st_fields(row: dict) -> List[str]:
+    """Campos do aluno, do jeito que o AtenaME grava no .gab (e que o
+    grade.py compara com a pauta)."""
+    return [
+        s.replace('_', '-').replace(',', '-').replace(':', '-')
+        for s in (row['chamada'], row['email'], row['dre'])
+    ]
+
+
+def synth_gab(pauta: List[dict], num_items: int = 10,
+              num_alternativas: int = 5, dont_know: bool = True,
+              num_sem_nome: int = 0, seed: int = 0) -> Gab:
+    """Gab com uma prova (embaralhada) para cada aluno da pauta, na
+    ordem da pauta, seguida de `num_sem_nome' provas sem nome."""
+    rng = random.Random(seed)
+    nr = num_alternativas + dont_know
+    gab = Gab("Formato 1", len(pauta) + num_sem_nome, num_items, nr,
+              dont_know)
+    gab.testes_com_nome = []
+    gab.testes_sem_nome = []
+    for i in range(len(pauta) + num_sem_nome):
+        perm = list(range(num_items))
+        rng.shuffle(perm)
+        items = []
+        for j in perm:
+            p = list(range(num_alternativas))
+            rng.shuffle(p)
+            items.append(MCItem(right=p.index(0),
+                                num_answers=nr,
+                                perm=_GabReader.Permutation(p),
+                                num_orig=j,
+                                right_orig=0))
+        if i < len(pauta):
+            st = _GabReader.Student(nome=pauta[i]['nomecompleto'],
+                                    fields=_st_fields(pauta[i]))
+            gab.testes_com_nome.append(
+                MCTest(_GabReader.Permutation(perm), st, items))
+        else:
+            gab.testes_sem_nome.append(
+                MCTest(_GabReader.Permutation(perm), None, items))
+    gab.keys = [MCKey(1 << 0, length=nr) for _ in range(num_items)]
+    return gab
+
+
+###
+### Respostas do Moodle
+###
+
+def _tentativa(rng, test: MCTest, dont_know: bool, tipo: str,
+               habilidade: float) -> List[str]:
+    """Respostas de uma tentativa, no formato do Moodle.
+
+    tipo: 'vazia' (tudo em branco), 'naosei' (só brancos e "Não
+    sei."), 'positiva' (pelo menos uma alternativa marcada) ou
+    'completa' (no máximo 2 itens sem alternativa marcada).
+    """
+    resp = []
+    for it in test.items:
+        if tipo == 'vazia':
+            resp.append('-')
+        elif tipo == 'naosei' and dont_know:
+            resp.append(rng.choice(['-', 'Não sei.']))
+        elif tipo == 'naosei':
+            resp.append('-')
+        elif rng.random() < habilidade:
+            resp.append(f"({chr(ord('a') + it.right)})")
+        else:
+            letra = chr(ord('a') + rng.randrange(len(it.perm)))
+            resp.append(f"({letra})")
+    if tipo == 'naosei' and dont_know:
+        resp[rng.randrange(len(resp))] = 'Não sei.'
+    if tipo == 'positiva':
+        # Deixa alguns itens sem alternativa marcada
+        for k in rng.sample(range(len(resp)), rng.randint(
+                0, len(resp) - 1)):
+            resp[k] = 'Não sei.' if dont_know else '-'
+    return resp
+
+
+def synth_respostas(gab: Gab, pauta: List[dict],
+                    seed: int = 0) -> List[dict]:
+    """Linhas do Respostas.csv do Moodle, com padrões de tentativas
+    variados: alunos que faltaram, com uma tentativa, com várias
+    tentativas vazias, sem tentativas positivas, com exatamente uma
+    tentativa positiva, e com várias tentativas positivas sendo que a
+    última está completa."""
+    rng = random.Random(seed)
+    linhas = []
+    for row, test in zip(pauta, gab.testes_com_nome):
+        habilidade = rng.random()
+        padrao = rng.choices(
+            ['noshow', 'one', 'empty', 'naosei', 'onepos', 'lastpos'],
+            weights=[5, 60, 2, 3, 10, 20])[0]
+        if padrao == 'noshow':
+            tipos = []
+        elif padrao == 'one':
+            tipos = [rng.choice(['positiva', 'completa'])]
+        elif padrao == 'empty':
+            tipos = ['vazia'] * rng.randint(2, 3)
+        elif padrao == 'naosei':
+            tipos = rng.sample(['vazia', 'naosei', 'naosei'], 2)
+        elif padrao == 'onepos':
+            tipos = ['vazia', 'positiva']
+            rng.shuffle(tipos)
+        else:
+            tipos = ['positiva'] * rng.randint(1, 2) + ['completa']
+            if rng.random() < 0.5:
+                tipos.append('vazia')
+        sobrenome, nome = row['nomecompleto'].split(' ', 1)[::-1]
+        for tipo in tipos:
+            resp = _tentativa(rng, test, gab.dont_know, tipo, habilidade)
+            linha = {
+                'Sobrenome': sobrenome,
+                'Nome': nome,
+                'Endereço de email': row['email'],
+                'Estado': 'Finalizada',
+                'Iniciado em': '1 dezembro 2020  10:00',
+                'Completo': '1 dezembro 2020  11:00',
+                'Tempo utilizado': '1 hora',
+                'Avaliar/10,00': '-',
+            }
+            for k, r in enumerate(resp):
+                linha[f'Resposta {k + 1}'] = r
+            linhas.append(linha)
+    return linhas
+
+
+def write_respostas_csv(linhas: List[dict], num_items: int, path):
+    fieldnames = [
+        'Sobrenome', 'Nome', 'Endereço de email', 'Estado',
+        'Iniciado em', 'Completo', 'Tempo utilizado', 'Avaliar/10,00',
+    ] + [f'Resposta {k + 1}' for k in range(num_items)]
+    with open(path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=fieldnames,
+                                lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(linhas)
+
+
+###
+### Lote PDF
+###
+
+def _pdf_texto(linhas: List[str]) -> bytes:
+    """Content stream com uma linha de texto embaixo da outra."""
+    ops = [b"BT /F1 10 Tf 50 800 Td 12 TL"]
+    for linha in linhas:
+        linha = linha.replace('\\', '\\\\').replace('(', '\\(')
+        linha = linha.replace(')', '\\)')
+        ops.append(b"(" + linha.encode('latin-1') + b") '")
+    ops.append(b"ET")
+    return b"\n".join(ops)
+
+
+def write_lote_pdf(pauta: List[dict], path, skip_pages: int,
+                   pages_per_test: int = 1, num_sem_nome: int = 0):
+    """Escreve um lote de provas mínimo (só texto), parecido com o do
+    AtenaME: `skip_pages' páginas de lista de presença e depois
+    `pages_per_test' páginas por prova, cada uma com o nome e o DRE
+    do aluno. As provas sem nome vêm no final, sem nome escrito."""
+    conteudos = []
+    for p in range(skip_pages):
+        i0 = p * NOMES_POR_PAGINA_PRESENCA
+        nomes = [r['nomecompleto'] for r in
+                 pauta[i0:i0 + NOMES_POR_PAGINA_PRESENCA]]
+        conteudos.append(_pdf_texto(["LISTA DE PRESENCA"] + nomes))
+    for row in pauta + [None] * num_sem_nome:
+        for k in range(pages_per_test):
+            nome = row['nomecompleto'] if row else "_" * 30
+            dre = row['dre'] if row else "_" * 9
+            conteudos.append(_pdf_texto([
+                "ALGEBRA LINEAR",
+                f"Nome: {nome}",
+                f"DRE: {dre}",
+                f"Pagina {k + 1} de {pages_per_test}",
+            ]))
+
+    # Objetos: 1 = catálogo, 2 = árvore de páginas, 3 = fonte, e
+    # depois (página, conteúdo) para cada página.
+    num_pages = len(conteudos)
+    kids = ' '.join(f"{4 + 2*i} 0 R" for i in range(num_pages))
+    objetos = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{kids}] /Count {num_pages} >>"
+        .encode(),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, conteudo in enumerate(conteudos):
+        objetos.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> "
+            f"/Contents {5 + 2*i} 0 R >>".encode())
+        objetos.append(
+            f"<< /Length {len(conteudo)} >>\nstream\n".encode()
+            + conteudo + b"\nendstream")
+
+    with open(path, 'wb') as file:
+        file.write(b"%PDF-1.4\n")
+        offsets = []
+        for n, obj in enumerate(objetos, start=1):
+            offsets.append(file.tell())
+            file.write(f"{n} 0 obj\n".encode() + obj + b"\nendobj\n")
+        xref = file.tell()
+        file.write(f"xref\n0 {len(objetos) + 1}\n".encode())
+        file.write(b"0000000000 65535 f \n")
+        for off in offsets:
+            file.write(f"{off:010} 00000 n \n".encode())
+        file.write(
+            f"trailer\n<< /Size {len(objetos) + 1} /Root 1 0 R >>\n"
+            f"startxref\n{xref}\n%%EOF\n".encode())
+
+
+def num_presence_pages(num_students: int) -> int:
+    return -(-num_students // NOMES_POR_PAGINA_PRESENCA)
+
+
+def synth_all(outdir, num_students: int, num_items: int = 10,
+              num_alternativas: int = 5, dont_know: bool = True,
+              pages_per_test: int = 1, seed: int = 0, pdf: bool = True):
+    """Gera todos os arquivos dentro do diretório `outdir'. Retorna a
+    quantidade de páginas de lista de presença do lote."""
+    outdir = pathlib.Path(outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
+    pauta = synth_pauta(num_students, seed=seed)
+    write_pauta_csv(pauta, outdir / "PautaAtena.csv")
+    gab = synth_gab(pauta, num_items, num_alternativas, dont_know,
+                    seed=seed)
+    gab.to_gab_file(outdir / "Lote.gab")
+    write_respostas_csv(synth_respostas(gab, pauta, seed=seed),
+                        num_items, outdir / "Respostas.csv")
+    skip_pages = num_presence_pages(num_students)
+    if pdf:
+        write_lote_pdf(pauta, outdir / "Lote.pdf", skip_pages,
+                       pages_per_test)
+    with open(outdir / "known_values.csv", 'w') as file:
+        file.write("pgnum,dre\n")
+    return skip_pages
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Gera pauta, gabarito, respostas e lote de provas "
+                    "sintéticos.")
+
+    parser.add_argument(
+        "NUM_ALUNOS",
+        help="Quantidade de alunos na pauta.",
+        type=int,
+    )
+
+    parser.add_argument(
+        "OUTDIR",
+        help="Diretório onde os arquivos serão gerados.",
+        type=pathlib.Path,
+    )
+
+    parser.add_argument(
+        "--num-items",
+        help="Quantidade de questões da prova.",
+        type=int,
+        default=10,
+    )
+
+    parser.add_argument(
+        "--num-alternativas",
+        help="Quantidade de alternativas de cada questão, sem contar o "
+             "\"Não sei.\".",
+        type=int,
+        default=5,
+    )
+
+    parser.add_argument(
+        "--no-dont-know",
+        help="Gera provas sem a alternativa \"Não sei.\".",
+        action='store_false',
+        dest='dont_know',
+    )
+
+    parser.add_argument(
+        "--pages-per-test",
+        help="Quantidade de páginas de cada prova no lote.",
+        type=int,
+        default=1,
+    )
+
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+    )
+
+    args = parser.parse_args()
+
+    skip_pages = synth_all(
+        args.OUTDIR, args.NUM_ALUNOS, args.num_items,
+        args.num_alternativas, args.dont_know, args.pages_per_test,
+        args.seed)
+    print(f"SKIP_PAGES = {skip_pages}")
@@ -0,0 +1,124 @@
+"""Tabelas simples (uma lista por coluna), lidas e escritas com o módulo
+csv, para os scripts que não precisam do pandas: só importar o pandas
+leva uns 0,5 s, o que pesa em cada execução do grade.py.
+
+O CSV escrito por `Tabela.to_csv' é igual ao do DataFrame.to_csv (com
+o índice), e `Tabela.to_dataframe' converte para um DataFrame quando
+for preciso (só aí o pandas é importado).
+"""
+
+import os
+import csv
+import math
+import collections
+from typing import Dict, Iterable, Iterator, List, Optional
+
+
+def _formatar(x) -> str:
+    """Valor como o DataFrame.to_csv escreve: vazio para os valores
+    faltando (None ou NaN), e str() para o resto."""
+    if x is None or (isinstance(x, float) and math.isnan(x)):
+        return ''
+    return str(x)
+
+
+class Tabela:
+    """Colunas (listas, todas do mesmo tamanho) com um índice inteiro,
+    como um DataFrame lido com read_csv(..., index_col=...).
+
+    Os valores lidos do CSV são strings, e as células vazias são None.
+    """
+
+    def __init__(self, colunas: Dict[str, list], index: List[int],
+                 index_name: Optional[str] = None):
+        self.colunas = {c: list(v) for c, v in colunas.items()}
+        self.index = list(index)
+        self.index_name = index_name
+        for c, v in self.colunas.items():
+            if len(v) != len(self.index):
+                raise ValueError(
+                    f"Coluna '{c}' com {len(v)} valores, mas o índice "
+                    f"tem {len(self.index)}.")
+
+    @classmethod
+    def read_csv(cls, path, index_col: Optional[str] = None):
+        """Lê um CSV com cabeçalho. Se `index_col' for dado, essa coluna
+        (de inteiros) vira o índice; se não, o índice é 0, 1, 2, ..."""
+        with open(path, newline='', encoding='utf-8-sig') as file:
+            reader = csv.reader(file)
+            header = next(reader)
+            linhas = [linha for linha in reader if linha]
+        for num, linha in enumerate(linhas, start=2):
+            if len(linha) != len(header):
+                raise ValueError(
+                    f"{path}, linha {num}: esperava {len(header)} "
+                    f"campos, encontrei {len(linha)}.")
+        valores = zip(*linhas) if linhas else [()] * len(header)
+        colunas = {c: [x if x != '' else None for x in v]
+                   for c, v in zip(header, valores)}
+        if index_col is None:
+            return cls(colunas, range(len(linhas)))
+        if index_col not in colunas:
+            raise ValueError(f"{path}: coluna '{index_col}' não "
+                             f"encontrada.")
+        index = [int(x) for x in colunas.pop(index_col)]
+        return cls(colunas, index, index_col)
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self.colunas)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, coluna):
+        return coluna in self.colunas
+
+    def __getitem__(self, coluna) -> list:
+        return self.colunas[coluna]
+
+    def __setitem__(self, coluna, valores: Iterable):
+        valores = list(valores)
+        if len(valores) != len(self.index):
+            raise ValueError(
+                f"Coluna '{coluna}' com {len(valores)} valores, mas a "
+                f"tabela tem {len(self.index)} linhas.")
+        self.colunas[coluna] = valores
+
+    def take(self, positions: Iterable[int]) -> 'Tabela':
+        """Uma nova tabela só com as linhas nessas posições."""
+        positions = list(positions)
+        return Tabela(
+            {c: [v[i] for i in positions]
+             for c, v in self.colunas.items()},
+            [self.index[i] for i in positions], self.index_name)
+
+    def itertuples(self, positions: Optional[Iterable[int]] = None
+                   ) -> Iterator[tuple]:
+        """Como o DataFrame.itertuples: namedtuples com o índice (campo
+        `Index') seguido das colunas. Se `positions' for dado, só as
+        linhas nessas posições, nessa ordem."""
+        Linha = collections.namedtuple(
+            'Linha', ['Index'] + self.columns, rename=True)
+        colunas = list(self.colunas.values())
+        if positions is None:
+            for linha in zip(self.index, *colunas):
+                yield Linha._make(linha)
+        else:
+            for i in positions:
+                yield Linha(self.index[i], *(v[i] for v in colunas))
+
+    def to_csv(self, path):
+        with open(path, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file, lineterminator=os.linesep)
+            writer.writerow([self.index_name or ''] + self.columns)
+            for linha in zip(self.index, *self.colunas.values()):
+                writer.writerow([linha[0]]
+                                + [_formatar(x) for x in linha[1:]])
+
+    def to_dataframe(self):
+        """A mesma tabela, como um pandas.DataFrame."""
+        import pandas as pd
+        return pd.DataFrame(
+            self.colunas,
+            index=pd.Index(self.index, name=self.index_name))